@@ -0,0 +1,155 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def normalize_input(text):
+    # Case and whitespace don't change what the analysis is about
+    return " ".join((text or "").split()).lower()
+
+
+def input_hash(user_input, skills):
+    text = f"{normalize_input(user_input)}\0{normalize_input(skills)}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class AnalysisStore:
+    """Finished analyses in SQLite, so they can be reopened without running any stage again.
+
+    ``analyses`` has one row per analysis (its inputs, their normalized hash and when it was
+    created and last opened), ``analysis_stages`` one row per stage with its output as JSON,
+    how long it took and the provider/model that answered it. Analyses not opened for
+    ``retention`` seconds, and the least recently opened ones beyond ``max_entries``, are
+    deleted by ``compact``, which also runs every ``compact_every`` saves.
+
+    Without a ``path`` the analyses are kept in an in-memory database for the life of the
+    process. The database is opened on first use, not when the store is created.
+    """
+
+    def __init__(self, path=None, retention=30 * 24 * 3600, max_entries=10000, compact_every=100):
+        self.path = path
+        self.retention = retention
+        self.max_entries = max_entries
+        self.compact_every = compact_every
+        self._saves_since_compact = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _db(self):
+        # Only used with the lock held
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def _connect(self):
+        db = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "id TEXT PRIMARY KEY, input_hash TEXT NOT NULL, user_input TEXT NOT NULL, skills TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_stages ("
+            "analysis_id TEXT NOT NULL, stage TEXT NOT NULL, output TEXT NOT NULL, seconds REAL, model TEXT, "
+            "PRIMARY KEY (analysis_id, stage))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS analyses_input_hash ON analyses (input_hash, created_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS analyses_last_access ON analyses (last_access)")
+        db.commit()
+        return db
+
+    def save(self, results, user_input, skills, timings=None, models=None, analysis_id=None):
+        """Stores the stage outputs in ``results`` and returns the analysis id."""
+        analysis_id = analysis_id or uuid.uuid4().hex
+        timings = timings or {}
+        models = models or {}
+        now = time.time()
+        rows = [
+            (analysis_id, stage, json.dumps(output, default=str), timings.get(stage), models.get(stage))
+            for stage, output in results.items()
+        ]
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses (id, input_hash, user_input, skills, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (analysis_id, input_hash(user_input, skills), user_input or "", skills or "", now, now),
+            )
+            self._db.execute("DELETE FROM analysis_stages WHERE analysis_id = ?", (analysis_id,))
+            self._db.executemany(
+                "INSERT INTO analysis_stages (analysis_id, stage, output, seconds, model) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+            self._saves_since_compact += 1
+            if self._saves_since_compact >= self.compact_every:
+                self._compact(now)
+        return analysis_id
+
+    def load(self, analysis_id):
+        """The stored analysis as a dict with its inputs, ``results``, ``timings`` and ``models``, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT user_input, skills, created_at, last_access FROM analyses WHERE id = ?",
+                (analysis_id,),
+            ).fetchone()
+            if row is None or row[3] <= now - self.retention:
+                return None
+            stages = self._db.execute(
+                "SELECT stage, output, seconds, model FROM analysis_stages WHERE analysis_id = ?",
+                (analysis_id,),
+            ).fetchall()
+            self._db.execute("UPDATE analyses SET last_access = ? WHERE id = ?", (now, analysis_id))
+            self._db.commit()
+        return {
+            "id": analysis_id,
+            "user_input": row[0],
+            "skills": row[1],
+            "created_at": row[2],
+            "results": {stage: json.loads(output) for stage, output, _, _ in stages},
+            "timings": {stage: seconds for stage, _, seconds, _ in stages if seconds is not None},
+            "models": {stage: model for stage, _, _, model in stages if model is not None},
+        }
+
+    def find(self, user_input, skills):
+        """Id of the newest stored analysis of the same (normalized) input, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM analyses WHERE input_hash = ? AND last_access > ? ORDER BY created_at DESC LIMIT 1",
+                (input_hash(user_input, skills), time.time() - self.retention),
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, analysis_id):
+        with self._lock:
+            self._db.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+            self._db.execute("DELETE FROM analysis_stages WHERE analysis_id = ?", (analysis_id,))
+            self._db.commit()
+
+    def compact(self, vacuum=False):
+        """Applies the retention policy now; ``vacuum`` also gives the freed pages back to the filesystem."""
+        with self._lock:
+            self._compact(time.time())
+            if vacuum:
+                self._db.execute("VACUUM")
+
+    def _compact(self, now):
+        self._saves_since_compact = 0
+        self._db.execute("DELETE FROM analyses WHERE last_access <= ?", (now - self.retention,))
+        self._db.execute(
+            "DELETE FROM analyses WHERE id IN ("
+            "SELECT id FROM analyses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._db.execute("DELETE FROM analysis_stages WHERE analysis_id NOT IN (SELECT id FROM analyses)")
+        self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            analyses = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            stages = self._db.execute("SELECT COUNT(*) FROM analysis_stages").fetchone()[0]
+        return {"analyses": analyses, "stages": stages}
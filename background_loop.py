@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+
+class BackgroundLoop:
+    """An event loop running forever on a daemon thread.
+
+    Coroutines from any thread are scheduled on it with ``submit``. Async SDK clients
+    are pooled per loop, so everything submitted here shares the same warm clients.
+    """
+
+    def __init__(self, name="unified-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None or not _background_loop.thread.is_alive():
+            _background_loop = BackgroundLoop()
+        return _background_loop
+
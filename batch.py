@@ -0,0 +1,208 @@
+"""Headless batch runs of the career analysis pipeline.
+
+Reads (user_input, skills) records from JSONL or CSV, analyses them concurrently and
+appends one JSON line per finished record to the output file. Records already in the
+output file are skipped, so an interrupted run picks up where it stopped:
+
+    python batch.py cohort.csv -o results.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import time
+
+import career_assistant
+from career_assistant import (
+    MindCareerAssistant,
+    build_analysis_graph,
+    ANALYSIS_SECTIONS,
+)
+from scheduler import ProviderScheduler
+
+
+def record_id(record):
+    if record.get("id"):
+        return str(record["id"])
+    text = f"{record.get('user_input', '')}\0{record.get('skills', '')}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def load_records(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    for record in records:
+        record["id"] = record_id(record)
+    return records
+
+
+def completed_ids(output_path):
+    # The output file doubles as the checkpoint: every successful line is a finished record
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted write
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def limited_client(client, max_concurrency):
+    # A scheduler of its own for the run, with the same account limits as the app
+    limited = client.fork()
+    limited.scheduler = ProviderScheduler(
+        max_concurrency=max_concurrency,
+        name=f"batch/{client.provider}/{client.model}",
+        **career_assistant.rate_limits(client.provider, client.model),
+    )
+    return limited
+
+
+async def analyze_record(assistant, record, max_stage_concurrency):
+    graph = build_analysis_graph(
+        assistant,
+        record.get("user_input", ""),
+        record.get("skills", ""),
+        max_concurrency=max_stage_concurrency,
+    )
+    results = await graph.run()
+    analysis = {name: results[name] for name in ANALYSIS_SECTIONS}
+    analysis["job_market_data"] = results["job_categories"].to_dict(orient="records")
+    return analysis, graph.timings
+
+
+async def run_batch(
+    records,
+    output_path,
+    concurrency=8,
+    openai_concurrency=8,
+    anthropic_concurrency=8,
+    max_stage_concurrency=career_assistant.ANALYSIS_CONCURRENCY,
+    progress=print,
+):
+    done = completed_ids(output_path)
+    pending = [record for record in records if record["id"] not in done]
+    if done:
+        progress(
+            f"Skipping {len(records) - len(pending)} records already in {output_path}"
+        )
+
+    # One set of clients for the whole run, so the per-provider limits apply across records
+    openai_client = limited_client(career_assistant.openai_client, openai_concurrency)
+    claude_client = limited_client(
+        career_assistant.claude_client, anthropic_concurrency
+    )
+    record_slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+
+        async def process(record):
+            nonlocal failures
+            async with record_slots:
+                assistant = MindCareerAssistant(
+                    openai_client=openai_client, claude_client=claude_client
+                )
+                record_start = time.perf_counter()
+                result = {
+                    "id": record["id"],
+                    "user_input": record.get("user_input", ""),
+                    "skills": record.get("skills", ""),
+                }
+                try:
+                    analysis, timings = await analyze_record(
+                        assistant, record, max_stage_concurrency
+                    )
+                    result.update(status="ok", analysis=analysis, stage_seconds=timings)
+                except Exception as e:
+                    failures += 1
+                    result.update(status="error", error=f"{type(e).__name__}: {e}")
+                latency = time.perf_counter() - record_start
+                result["seconds"] = latency
+                latencies.append(latency)
+                # Written as soon as the record finishes, so partial runs keep their results
+                output.write(json.dumps(result, default=str) + "\n")
+                output.flush()
+                progress(
+                    f"[{len(latencies)}/{len(pending)}] {record['id']} {result['status']} in {latency:.1f}s"
+                )
+
+        await asyncio.gather(*(process(record) for record in pending))
+
+    elapsed = time.perf_counter() - start
+    return {
+        "records": len(pending),
+        "skipped": len(records) - len(pending),
+        "failed": failures,
+        "elapsed_seconds": elapsed,
+        "records_per_minute": len(pending) / elapsed * 60 if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p90": percentile(latencies, 0.90),
+        "latency_p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run career analyses for a JSONL or CSV file of (user_input, skills) records."
+    )
+    parser.add_argument(
+        "input",
+        help="JSONL or CSV file with user_input and skills fields (and optionally id)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="results.jsonl",
+        help="JSONL file results are appended to",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="records analysed at the same time"
+    )
+    parser.add_argument(
+        "--openai-concurrency", type=int, default=8, help="in-flight OpenAI requests"
+    )
+    parser.add_argument(
+        "--anthropic-concurrency",
+        type=int,
+        default=8,
+        help="in-flight Anthropic requests",
+    )
+    args = parser.parse_args()
+
+    summary = asyncio.run(
+        run_batch(
+            load_records(args.input),
+            args.output,
+            concurrency=args.concurrency,
+            openai_concurrency=args.openai_concurrency,
+            anthropic_concurrency=args.anthropic_concurrency,
+        )
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""Microbenchmarks for the UnifiedApis, parsing and rendering hot paths.
+
+Runs offline: SDK responses are prebuilt stub objects, so only this repo's code is timed.
+Every benchmark runs at a realistic and a pathological size. The startup benchmarks instead
+time a fresh interpreter importing the app and rendering its first page (OFFLINE=1):
+
+    python bench.py                          # print a table
+    python bench.py --json bench.json        # also write machine-readable results
+    python bench.py --compare bench.json     # exit 1 if anything got >20% slower
+    python bench.py -k stream --repeat 20    # only benchmarks whose name contains "stream"
+    python bench.py -k startup               # cold start only
+    python bench.py -k json_stages           # fused vs. three separate JSON calls
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from unified import UnifiedApis
+
+BENCHMARKS = []
+
+PROFILE_TEXT = (
+    "I'm feeling excited about new opportunities in tech. My goal is to transition "
+    "into a data science role within the next year."
+)
+
+
+def benchmark(name, sizes, number=1):
+    """Registers ``factory(size) -> (setup, run)``; ``run(setup())`` is timed ``number`` times per repeat."""
+
+    def register(factory):
+        for label, size in sizes.items():
+            BENCHMARKS.append(
+                {
+                    "name": f"{name}[{label}]",
+                    "size": size,
+                    "number": number,
+                    "factory": factory,
+                }
+            )
+        return factory
+
+    return register
+
+
+def words(count, seed=0):
+    vocabulary = "career skills growth market data role team plan learn impact".split()
+    return " ".join(vocabulary[(seed + i) % len(vocabulary)] for i in range(count))
+
+
+def make_client(**kwargs):
+    return UnifiedApis(
+        provider="openai", api_key="bench", should_print_init=False, **kwargs
+    )
+
+
+class StubStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class StubAsyncOpenAI:
+    """Returns the same prebuilt stream for every request."""
+
+    def __init__(self, chunks):
+        async def create(**params):
+            return StubStream(chunks)
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+def stream_chunks(pieces):
+    return [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        for piece in pieces
+    ]
+
+
+def tagged_reply(tags, words_per_tag):
+    return "\n".join(
+        f"<{tag}>{words(words_per_tag, i)}</{tag}>" for i, tag in enumerate(tags)
+    )
+
+
+@benchmark("add_message", {"realistic": 50, "pathological": 20000})
+def bench_add_message(size):
+    message = words(60)
+
+    def setup():
+        return make_client(max_history_words=None)
+
+    def run(client):
+        for i in range(size):
+            client.add_message("user" if i % 2 == 0 else "assistant", message)
+
+    return setup, run
+
+
+@benchmark("trim_history", {"realistic": 50, "pathological": 20000})
+def bench_trim_history(size):
+    # Steady state of a long chat: every new message pushes the oldest one out
+    message = words(60)
+
+    def setup():
+        client = make_client(max_history_words=4000)
+        for i in range(100):
+            client.add_message("user", message)
+        client.trim_history()
+        return client
+
+    def run(client):
+        for i in range(size):
+            client.add_message("user" if i % 2 == 0 else "assistant", message)
+            client.trim_history()
+
+    return setup, run
+
+
+@benchmark("remove_previous_cache_keys", {"realistic": 50, "pathological": 20000})
+def bench_remove_cache_keys(size):
+    message = words(20)
+
+    def setup():
+        client = make_client(max_history_words=None, use_cache=True, cache_interval=1)
+        for i in range(size):
+            client.add_message("user", message)
+        return client
+
+    def run(client):
+        client.remove_previous_cache_keys()
+
+    return setup, run
+
+
+@benchmark("stream_assembly", {"realistic": 500, "pathological": 10000})
+def bench_stream_assembly(size):
+    chunks = stream_chunks(f"{word} " for word in words(size).split())
+    loop = asyncio.new_event_loop()
+
+    def setup():
+        client = make_client(use_async=True)
+        client.client = StubAsyncOpenAI(chunks)
+        client.add_message("user", "Tell me about my career")
+        return client
+
+    def run(client):
+        loop.run_until_complete(client.get_response_async(should_print=False))
+
+    return setup, run
+
+
+@benchmark("stream_async", {"realistic": 500, "pathological": 10000})
+def bench_stream_async(size):
+    # The same stream consumed as deltas through the generator API
+    chunks = stream_chunks(f"{word} " for word in words(size).split())
+    loop = asyncio.new_event_loop()
+
+    def setup():
+        client = make_client(use_async=True, sink=None)
+        client.client = StubAsyncOpenAI(chunks)
+        return client
+
+    async def consume(client):
+        async for event in client.stream_async("Tell me about my career"):
+            pass
+
+    def run(client):
+        loop.run_until_complete(consume(client))
+
+    return setup, run
+
+
+@benchmark("stream_tag_parser", {"realistic": 500, "pathological": 10000})
+def bench_stream_tag_parser(size):
+    from career_assistant import INDUSTRY_FORECAST_TAGS
+    from tag_stream import TagStreamParser
+
+    reply = tagged_reply(INDUSTRY_FORECAST_TAGS, size // len(INDUSTRY_FORECAST_TAGS))
+    # Split into small chunks the way tokens arrive, so tags straddle chunk boundaries
+    pieces = [reply[i : i + 4] for i in range(0, len(reply), 4)][:size]
+
+    def setup():
+        return TagStreamParser(INDUSTRY_FORECAST_TAGS, on_update=lambda *args: None)
+
+    def run(parser):
+        for piece in pieces:
+            parser.feed(piece)
+        parser.result()
+
+    return setup, run
+
+
+@benchmark(
+    "parse_claude_response", {"realistic": 300, "pathological": 100000}, number=10
+)
+def bench_parse_claude_response(size):
+    from career_assistant import INDUSTRY_FORECAST_TAGS, parse_claude_response
+
+    reply = tagged_reply(INDUSTRY_FORECAST_TAGS, size // len(INDUSTRY_FORECAST_TAGS))
+
+    def setup():
+        return reply
+
+    def run(reply):
+        parse_claude_response(reply, INDUSTRY_FORECAST_TAGS)
+
+    return setup, run
+
+
+@benchmark("analysis_charts", {"realistic": 5, "pathological": 2000})
+def bench_analysis_charts(size):
+    # The DataFrames and plotly figures display_analysis_results builds on every rerun
+    import pandas as pd
+
+    from main import alignment_scores_chart, job_growth_chart, top_alignments_chart
+
+    alignments = [
+        {"job_title": f"Job {i}", "score": (i % 100) / 100, "reason": words(20, i)}
+        for i in range(size)
+    ]
+    growth = [
+        {"job_title": f"Job {i}", "growth_rate": (i % 40) / 100} for i in range(size)
+    ]
+
+    def setup():
+        return None
+
+    def run(_):
+        top = sorted(alignments, key=lambda x: x["score"], reverse=True)[:5]
+        top_alignments_chart(top)
+        job_growth_chart(pd.DataFrame(growth))
+        alignment_scores_chart(alignments)
+
+    return setup, run
+
+
+def json_stage_assistant():
+    # The JSON stages against the local provider, with a simulated round trip and generation speed
+    from career_assistant import MindCareerAssistant
+    from local_provider import AsyncLocalClient
+    from router import Router
+    from telemetry import Telemetry
+
+    client = UnifiedApis(
+        provider="local",
+        use_async=True,
+        json_mode=True,
+        telemetry=Telemetry(),
+        should_print_init=False,
+    )
+    client.client = AsyncLocalClient(ttft=0.3, tokens_per_second=200)
+    return MindCareerAssistant(
+        openai_client=client,
+        claude_client=client,
+        chat_client=client,
+        router=Router(),
+        json_candidates=[client],
+    )
+
+
+def json_stage_metrics(assistant):
+    # Token totals over the calls of one run, reported next to the timings
+    records = assistant.openai_client.telemetry.records
+    metrics = {
+        "calls": len(records),
+        "input_tokens": sum(record["input_tokens"] for record in records),
+        "output_tokens": sum(record["output_tokens"] for record in records),
+    }
+    records.clear()
+    return metrics
+
+
+@benchmark("json_stages_three_calls", {"offline": 1})
+def bench_json_stages_three_calls(size):
+    loop = asyncio.new_event_loop()
+
+    async def stages(assistant):
+        async def categories_and_alignments():
+            await assistant.update_job_categories(PROFILE_TEXT)
+            await assistant.analyze_job_market_alignment(PROFILE_TEXT)
+
+        await asyncio.gather(
+            categories_and_alignments(), assistant.analyze_mood(PROFILE_TEXT)
+        )
+
+    def run(assistant):
+        loop.run_until_complete(stages(assistant))
+        return json_stage_metrics(assistant)
+
+    return json_stage_assistant, run
+
+
+@benchmark("json_stages_fused", {"offline": 1})
+def bench_json_stages_fused(size):
+    loop = asyncio.new_event_loop()
+
+    def run(assistant):
+        loop.run_until_complete(assistant.analyze_profile(PROFILE_TEXT))
+        return json_stage_metrics(assistant)
+
+    return json_stage_assistant, run
+
+
+def python_process(code):
+    # A new interpreter each time, so nothing is already imported
+    env = {**os.environ, "OFFLINE": "1"}
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return lambda _: subprocess.run(
+        [sys.executable, "-c", code], cwd=directory, env=env, check=True, capture_output=True
+    )
+
+
+@benchmark("startup_import", {"cold": 1})
+def bench_startup_import(size):
+    # What every Streamlit worker pays before it can run the script
+    return lambda: None, python_process("import main")
+
+
+@benchmark("startup_first_render", {"cold": 1})
+def bench_startup_first_render(size):
+    # From a bare interpreter to the input form being fully rendered
+    return lambda: None, python_process(
+        "from streamlit.testing.v1 import AppTest\n"
+        "AppTest.from_file('main.py', default_timeout=120).run()"
+    )
+
+
+def measure(spec, repeat):
+    setup, run = spec["factory"](spec["size"])
+    # One untimed pass warms imports and caches
+    run(setup())
+    timings = []
+    metrics = None
+    for _ in range(repeat):
+        states = [setup() for _ in range(spec["number"])]
+        start = time.perf_counter()
+        for state in states:
+            # A run may return a dict of other measurements (e.g. token counts) to report
+            metrics = run(state)
+        timings.append((time.perf_counter() - start) / spec["number"])
+    result = {
+        "name": spec["name"],
+        "size": spec["size"],
+        "repeat": repeat,
+        "number": spec["number"],
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "mean_s": statistics.fmean(timings),
+        "stdev_s": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "per_item_us": statistics.median(timings) / spec["size"] * 1e6,
+    }
+    if isinstance(metrics, dict):
+        result["metrics"] = metrics
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        if result["name"] not in previous:
+            continue
+        ratio = result["median_s"] / previous[result["name"]]["median_s"]
+        result["baseline_ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-k",
+        "--filter",
+        default="",
+        help="only run benchmarks whose name contains this",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=7, help="timed runs per benchmark"
+    )
+    parser.add_argument("--json", help="write results to this JSON file")
+    parser.add_argument(
+        "--compare", help="baseline JSON file from an earlier --json run"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed slowdown against the baseline median (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for spec in BENCHMARKS:
+        if args.filter not in spec["name"]:
+            continue
+        # UnifiedApis prints stream output and status lines; keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = measure(spec, args.repeat)
+        results.append(result)
+        print(
+            f"{result['name']:<42} median {result['median_s'] * 1e3:10.3f} ms"
+            f"  min {result['min_s'] * 1e3:10.3f} ms  {result['per_item_us']:9.3f} us/item"
+            + "".join(
+                f"  {name} {value}" for name, value in result.get("metrics", {}).items()
+            )
+        )
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for result in regressions:
+            print(
+                f"REGRESSION {result['name']}: {result['baseline_ratio']:.2f}x the baseline median"
+            )
+
+    if args.json:
+        report = {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,970 @@
+from unified import TerminalSink, UnifiedApis, count_tokens
+from response_cache import ResponseCache
+from render_cache import RenderCache
+from analysis_store import AnalysisStore
+from background_loop import get_background_loop
+from jobs import JobQueue
+from scheduler import get_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from summarizer import ConversationSummarizer
+from telemetry import Telemetry, JsonlExporter
+from single_flight import SingleFlight
+from hedging import HedgePolicy
+from router import Router
+from stage_graph import StageGraph
+from retrieval import BM25Index, split_words
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List
+import asyncio
+import functools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+# Identical profiles get resubmitted often ("Start Over", the placeholder examples), so the
+# analysis answers are cached. Set RESPONSE_CACHE_PATH to keep them across restarts.
+response_cache = ResponseCache(path=os.getenv("RESPONSE_CACHE_PATH"))
+
+# Figures and section payloads of finished analyses, built once per analysis id and re-drawn
+# from here on every Streamlit rerun
+render_cache = RenderCache()
+
+# Finished analyses, so they can be reopened or shared by link without running again. They
+# are kept across restarts in ANALYSIS_STORE_PATH (":memory:" keeps them for the life of the
+# process only), opened on the first save or load; ANALYSIS_RETENTION_DAYS sets how long one
+# is kept after it was last opened.
+analysis_store = AnalysisStore(
+    path=os.getenv("ANALYSIS_STORE_PATH", "analyses.sqlite"),
+    retention=float(os.getenv("ANALYSIS_RETENTION_DAYS", "30")) * 24 * 3600,
+)
+
+# Every LLM call is recorded here with its stage label. Set TELEMETRY_JSONL to also append
+# the records to a file.
+telemetry = Telemetry()
+if os.getenv("TELEMETRY_JSONL"):
+    telemetry.add_listener(JsonlExporter(os.getenv("TELEMETRY_JSONL")))
+
+# Sessions submitting the same profile at the same moment (the placeholder text, a class
+# using one template) share each analysis call instead of paying for it once per session
+single_flight = SingleFlight()
+
+# In-flight requests allowed per provider and model across all sessions
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", "16"))
+
+
+def rate_limits(provider, model=None):
+    # Account limits from the environment, per model (OPENAI_GPT_4O_MINI_RPM=5000) or else per
+    # provider (OPENAI_RPM=500 OPENAI_TPM=30000), which then applies to each of its models;
+    # unset means unlimited
+    prefixes = [provider.upper()]
+    if model:
+        prefixes.insert(0, re.sub(r"[^A-Z0-9]+", "_", f"{provider}_{model}".upper()))
+
+    def limit(suffix):
+        for prefix in prefixes:
+            value = int(os.getenv(f"{prefix}_{suffix}", "0"))
+            if value:
+                return value
+        return None
+
+    return {"requests_per_minute": limit("RPM"), "tokens_per_minute": limit("TPM")}
+
+
+def provider_scheduler(provider, model, max_concurrency=PROVIDER_CONCURRENCY):
+    return get_scheduler(
+        provider, model, max_concurrency=max_concurrency, **rate_limits(provider, model)
+    )
+
+
+# OFFLINE=1 answers every request with the built-in local provider (see local_provider.py), so
+# load tests are reproducible without network access or API keys
+OFFLINE = os.getenv("OFFLINE") == "1"
+
+
+def provider_settings(provider, model):
+    if OFFLINE:
+        return {"provider": "local", "model": f"local/{model}"}
+    return {"provider": provider, "model": model}
+
+
+# Streamed replies reach the page through on_chunk callbacks; echoing every token to the
+# server console as well costs a synchronous write per chunk, so it's opt-in
+# (STREAM_TO_CONSOLE=1) for debugging
+CONSOLE_SINK = TerminalSink() if os.getenv("STREAM_TO_CONSOLE") == "1" else None
+
+# Module-level UnifiedApis instances hold the provider settings and share the pooled SDK
+# clients. Conversations are never kept on them: every session forks its own.
+openai_client = UnifiedApis(
+    **provider_settings("openai", "gpt-4o"),
+    use_async=True,
+    json_mode=True,
+    sink=CONSOLE_SINK,
+    response_cache=response_cache,
+    scheduler=provider_scheduler("openai", "gpt-4o"),
+    telemetry=telemetry,
+    single_flight=single_flight,
+)
+
+# HEDGE_CLAUDE=1 races a late Claude stream against gpt-4o. The backup starts after
+# HEDGE_DELAY seconds without a first token, or by default after the rolling p90 of Claude's
+# time to first token.
+claude_hedge = None
+if os.getenv("HEDGE_CLAUDE") == "1":
+    claude_hedge = HedgePolicy(
+        UnifiedApis(
+            **provider_settings("openai", "gpt-4o"),
+            use_async=True,
+            sink=CONSOLE_SINK,
+            scheduler=provider_scheduler("openai", "gpt-4o"),
+            should_print_init=False,
+        ),
+        delay=float(os.getenv("HEDGE_DELAY")) if os.getenv("HEDGE_DELAY") else None,
+    )
+
+# Claude only caches prompt prefixes it is told to: the system message and the history up
+# to the newest question get cache breakpoints
+claude_client = UnifiedApis(
+    **provider_settings("anthropic", "claude-3-5-sonnet-20240620"),
+    use_async=True,
+    use_cache=True,
+    cache_breakpoints="auto",
+    sink=CONSOLE_SINK,
+    response_cache=response_cache,
+    scheduler=provider_scheduler("anthropic", "claude-3-5-sonnet-20240620"),
+    telemetry=telemetry,
+    single_flight=single_flight,
+    hedge=claude_hedge,
+)
+
+# Token budget for the follow-up chat history plus its running summary. Past it, all but the
+# newest CHAT_KEEP_TURNS turns are folded into the summary; CHAT_SUMMARY=0 only trims.
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_KEEP_TURNS = 3
+CHAT_SUMMARY = os.getenv("CHAT_SUMMARY", "1") != "0"
+
+# Folds older follow-up chat turns into a running summary on a cheaper model, after the reply
+# has been sent and behind every other request to the provider
+chat_summarizer = None
+if CHAT_SUMMARY:
+    chat_summarizer = ConversationSummarizer(
+        UnifiedApis(
+            **provider_settings("openai", "gpt-4o-mini"),
+            use_async=True,
+            sink=CONSOLE_SINK,
+            scheduler=provider_scheduler("openai", "gpt-4o-mini"),
+            priority=PRIORITY_BACKGROUND,
+            telemetry=telemetry,
+            should_print_init=False,
+        ),
+        max_tokens=CHAT_HISTORY_TOKENS,
+        keep_turns=CHAT_KEEP_TURNS,
+    )
+
+# Chat replies are waited on by a user, so they go ahead of queued analysis stages
+gemini_client = UnifiedApis(
+    **provider_settings("openrouter", "google/gemini-pro-1.5"),
+    use_async=True,
+    sink=CONSOLE_SINK,
+    scheduler=provider_scheduler("openrouter", "google/gemini-pro-1.5"),
+    priority=PRIORITY_INTERACTIVE,
+    telemetry=telemetry,
+    summarizer=chat_summarizer,
+)
+
+# Each stage goes to the fastest healthy provider out of its candidates and fails over to the
+# next one when a call fails. ROUTING=0 keeps every stage on its first candidate.
+ROUTING = os.getenv("ROUTING", "1") != "0"
+router = Router()
+telemetry.add_listener(router.observe)
+
+# FUSED_JSON_STAGES=1 asks for the job categories, mood and job alignments in one call
+# instead of three; parts of the answer that don't validate are asked for separately
+FUSED_JSON_STAGES = os.getenv("FUSED_JSON_STAGES") == "1"
+# The stages the fused call answers
+FUSED_STAGES = ("job_categories", "mood_analysis", "job_insights")
+
+# Maximum number of analysis stages that may wait on an LLM at the same time
+ANALYSIS_CONCURRENCY = 4
+# Upper bound on the follow-up chat history kept per session
+CHAT_HISTORY_WORDS = 4000
+# Token budget for the analysis summary and excerpts sent with each follow-up question
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1200"))
+# Most excerpts sent with a question, and the size they are cut into
+CHAT_CONTEXT_CHUNKS = 5
+CHUNK_WORDS = 80
+
+
+class CareerPathAnalysis(BaseModel):
+    short_term_prospects: str = Field(
+        min_length=1,
+        description="Analysis of immediate career opportunities",
+    )
+    long_term_prospects: str = Field(
+        min_length=1,
+        description="Potential career trajectory over the next 5-10 years",
+    )
+    challenges: str = Field(
+        min_length=1,
+        description="Potential obstacles or challenges in this career path",
+    )
+    growth_areas: str = Field(
+        min_length=1,
+        description="Key areas for skill development and personal growth",
+    )
+
+
+class SkillDevelopmentPlan(BaseModel):
+    core_skills: str = Field(
+        min_length=1,
+        description="List of essential skills for this career path",
+    )
+    skill_gaps: str = Field(
+        min_length=1,
+        description="Identification of skills the person needs to develop",
+    )
+    learning_resources: str = Field(
+        min_length=1,
+        description="Suggested courses, books, or online resources for skill development",
+    )
+    timeline: str = Field(
+        min_length=1,
+        description="Proposed timeline for skill acquisition (e.g., 3 months, 6 months, 1 year goals)",
+    )
+
+
+class IndustryForecast(BaseModel):
+    industries: str = Field(
+        min_length=1,
+        description="List the main industries relevant to the user's input and job categories",
+    )
+    technological_trends: str = Field(
+        min_length=1,
+        description="Key technological advancements expected in these industries",
+    )
+    market_shifts: str = Field(
+        min_length=1,
+        description="Predicted changes in market dynamics or consumer behavior",
+    )
+    potential_disruptions: str = Field(
+        min_length=1,
+        description="Possible disruptive forces or game-changing innovations",
+    )
+    career_implications: str = Field(
+        min_length=1,
+        description="How these trends might affect career opportunities in the identified industries",
+    )
+
+
+class MoodAnalysis(BaseModel):
+    sentiment: str = Field(
+        min_length=1,
+        description="Brief description of the sentiment",
+    )
+    score: float = Field(
+        ge=-1,
+        le=1,
+        description="A number between -1 (very negative) and 1 (very positive)",
+    )
+    analysis: str = Field(
+        min_length=1,
+        description="Detailed analysis of the person's mood and emotional state",
+    )
+    career_impact: str = Field(
+        min_length=1,
+        description="How this emotional state might affect career decisions or performance",
+    )
+
+
+class JobAlignment(BaseModel):
+    job_title: str = Field(min_length=1, description="Job title")
+    score: float = Field(
+        ge=0,
+        le=1,
+        description="A number between 0 and 1 indicating alignment",
+    )
+    reason: str = Field(description="Brief explanation of the alignment score")
+
+
+class ProfileAnalysis(BaseModel):
+    """The three JSON stages answered together in fused mode."""
+
+    job_categories: Dict[str, float] = Field(
+        min_length=5,
+        description="Job titles mapped to estimated growth rates as decimals",
+    )
+    mood_analysis: MoodAnalysis
+    alignments: List[JobAlignment] = Field(
+        min_length=1,
+        description="How well the text aligns with each of the job categories",
+    )
+
+
+def profile_parts(response):
+    """The parts of a fused answer that validate, by field name; the others are left out."""
+    try:
+        return ProfileAnalysis.model_validate(response).model_dump()
+    except ValidationError as e:
+        failed = {error["loc"][0] if error["loc"] else None for error in e.errors()}
+        if None in failed or not isinstance(response, dict):
+            return {}
+        print(f"Fused response failed validation for {sorted(failed)}: {e}")
+        return {
+            name: response[name]
+            for name in ProfileAnalysis.model_fields
+            if name not in failed
+        }
+
+
+# Stage prompts are a static prefix, sent as the system message, and the user's text as the
+# message. The prefix is then the same for every user, so providers can serve it from their
+# prompt cache: OpenAI does so automatically, Claude through the cache breakpoints UnifiedApis
+# places with cache_breakpoints="auto". Both only cache prefixes of 1024 tokens or more, and
+# the stage prompts are still well under that, so for now only long follow-up chats get hits.
+JOB_CATEGORIES_PROMPT = """Based on the text you are given, suggest at least 5 relevant job categories and their estimated growth rates.
+        If the text suggests fewer than 5 categories, add related or complementary job categories to reach a total of 5.
+        Return the result as a JSON object where keys are job titles and values are growth rates (as decimals, e.g., 0.25 for 25% growth)."""
+
+MOOD_PROMPT = """Analyze the sentiment of the text you are given. Return the result in the following JSON format:
+        {
+            "sentiment": "Brief description of the sentiment",
+            "score": A number between -1 (very negative) and 1 (very positive),
+            "analysis": "Detailed analysis of the person's mood and emotional state",
+            "career_impact": "How this emotional state might affect career decisions or performance"
+        }"""
+
+JOB_ALIGNMENT_PROMPT = """Analyze how well the text you are given aligns with each of the job categories listed with it. Return the result in the following JSON format:
+        {
+            "alignments": [
+                {
+                    "job_title": "Job title",
+                    "score": A number between 0 and 1 indicating alignment,
+                    "reason": "Brief explanation of the alignment score"
+                },
+                ...
+            ]
+        }"""
+
+PROFILE_PROMPT = """Analyze the text you are given in three parts and return the result in the following JSON format:
+        {
+            "job_categories": {
+                "Job title": Estimated growth rate as a decimal, e.g., 0.25 for 25% growth,
+                ...
+            },
+            "mood_analysis": {
+                "sentiment": "Brief description of the sentiment",
+                "score": A number between -1 (very negative) and 1 (very positive),
+                "analysis": "Detailed analysis of the person's mood and emotional state",
+                "career_impact": "How this emotional state might affect career decisions or performance"
+            },
+            "alignments": [
+                {
+                    "job_title": "Job title",
+                    "score": A number between 0 and 1 indicating alignment,
+                    "reason": "Brief explanation of the alignment score"
+                },
+                ...
+            ]
+        }
+        job_categories: at least 5 relevant job categories for the text. If the text suggests fewer, add related or complementary job categories to reach a total of 5.
+        mood_analysis: the sentiment of the text.
+        alignments: how well the text aligns with each of the job categories you listed, one entry per category."""
+
+CAREER_PATH_PROMPT = """Based on the user input and skills you are given, provide a detailed career path analysis. Consider both short-term and long-term career prospects, potential challenges, and areas for growth."""
+
+SKILL_PLAN_PROMPT = """Create a personalized skill development plan for someone aiming for the career goal you are given. Consider their current skills and suggest a roadmap for acquiring new skills or improving existing ones."""
+
+INDUSTRY_FORECAST_PROMPT = """Based on the user input and job categories you are given, forecast key trends and developments in the relevant industries over the next 5 years. Consider technological advancements, market shifts, and potential disruptions."""
+
+
+CAREER_PATH_TAGS = list(CareerPathAnalysis.model_fields)
+SKILL_PLAN_TAGS = list(SkillDevelopmentPlan.model_fields)
+INDUSTRY_FORECAST_TAGS = list(IndustryForecast.model_fields)
+
+
+class MindCareerAssistant:
+    def __init__(
+        self,
+        openai_client=openai_client,
+        claude_client=claude_client,
+        chat_client=gemini_client,
+        session_id=None,
+        router=router,
+        json_candidates=None,
+        tagged_candidates=None,
+        chat_fallbacks=None,
+    ):
+        self.openai_client = openai_client
+        self.claude_client = claude_client
+        self.router = router
+        # Candidates per kind of stage, preferred first. Prompts are adapted to each candidate:
+        # JSON-mode clients get tagged stages as a schema, the others get JSON stages as text.
+        self.json_candidates = json_candidates or [openai_client, claude_client]
+        self.tagged_candidates = tagged_candidates or [claude_client, openai_client]
+        self.chat_fallbacks = (
+            [claude_client] if chat_fallbacks is None else chat_fallbacks
+        )
+        if not ROUTING:
+            self.json_candidates = self.json_candidates[:1]
+            self.tagged_candidates = self.tagged_candidates[:1]
+            self.chat_fallbacks = []
+        # Identifies this session to the provider schedulers, which share slots fairly between sessions
+        self.session_id = session_id or uuid.uuid4().hex
+        # Follow-up chat keeps a bounded conversation that belongs to this session only
+        self.chat_client = chat_client.fork(
+            max_history_words=CHAT_HISTORY_WORDS,
+            session_id=self.session_id,
+            stage="follow_up_chat",
+        )
+        # Built on first use, so creating an assistant doesn't import pandas
+        self._job_market_data = None
+
+    @property
+    def job_market_data(self):
+        if self._job_market_data is None:
+            import pandas as pd
+
+            self._job_market_data = pd.DataFrame(
+                {
+                    "job_title": [
+                        "Data Scientist",
+                        "Software Engineer",
+                        "Product Manager",
+                        "UX Designer",
+                    ],
+                    "growth_rate": [0.3, 0.25, 0.2, 0.22],
+                }
+            )
+        return self._job_market_data
+
+    @job_market_data.setter
+    def job_market_data(self, value):
+        self._job_market_data = value
+
+    async def update_job_categories(self, query):
+        response = await self._ask_json(
+            JOB_CATEGORIES_PROMPT, f"Text: '{query}'", "job_categories"
+        )
+        return self._set_job_categories(response)
+
+    def _set_job_categories(self, response):
+        import pandas as pd
+
+        if isinstance(response, dict) and len(response) >= 5:
+            new_job_data = [
+                {"job_title": title, "growth_rate": rate}
+                for title, rate in response.items()
+            ]
+        else:
+            print(
+                f"Unexpected response format or insufficient job categories: {response}"
+            )
+            # Fallback to ensure at least 5 job categories
+            default_categories = [
+                "Data Scientist",
+                "Software Engineer",
+                "Product Manager",
+                "UX Designer",
+                "Marketing Specialist",
+            ]
+            new_job_data = [
+                {"job_title": title, "growth_rate": 0.2} for title in default_categories
+            ]
+
+        self.job_market_data = pd.DataFrame(new_job_data)
+
+        # Ensure we have exactly 5 categories
+        if len(self.job_market_data) > 5:
+            self.job_market_data = self.job_market_data.nlargest(5, "growth_rate")
+        elif len(self.job_market_data) < 5:
+            additional_categories = [
+                {"job_title": f"Additional Category {i}", "growth_rate": 0.1}
+                for i in range(5 - len(self.job_market_data))
+            ]
+            self.job_market_data = pd.concat(
+                [self.job_market_data, pd.DataFrame(additional_categories)]
+            )
+
+        return self.job_market_data
+
+    async def analyze_mood(self, text):
+        return await self._ask_json(MOOD_PROMPT, f"Text: {text}", "mood_analysis")
+
+    async def analyze_job_market_alignment(self, user_input):
+        job_categories = ", ".join(self.job_market_data["job_title"].tolist())
+        response = await self._ask_json(
+            JOB_ALIGNMENT_PROMPT,
+            f"Job categories: {job_categories}.\nText to analyze: '{user_input}'",
+            "job_insights",
+        )
+
+        # Add error handling and logging
+        if not isinstance(response, dict) or "alignments" not in response:
+            print(f"Unexpected response format: {response}")
+            return {"alignments": []}
+
+        return response
+
+    async def analyze_profile(self, user_input):
+        """Job categories, mood and job alignments from one call.
+
+        Returns a dict with the job_categories, mood_analysis and job_insights stage
+        results. A part of the answer that fails validation is asked for with its own
+        stage call instead; alignments are redone too when the categories were.
+        """
+        response = await self._ask_json(
+            PROFILE_PROMPT, f"Text: '{user_input}'", "profile_analysis"
+        )
+        parts = profile_parts(response)
+
+        async def categories_and_alignments():
+            if "job_categories" not in parts:
+                job_categories = await self.update_job_categories(user_input)
+                return job_categories, await self.analyze_job_market_alignment(
+                    user_input
+                )
+            job_categories = self._set_job_categories(parts["job_categories"])
+            if "alignments" not in parts:
+                return job_categories, await self.analyze_job_market_alignment(
+                    user_input
+                )
+            return job_categories, {"alignments": parts["alignments"]}
+
+        async def mood():
+            if "mood_analysis" in parts:
+                return parts["mood_analysis"]
+            return await self.analyze_mood(user_input)
+
+        (job_categories, job_insights), mood_analysis = await asyncio.gather(
+            categories_and_alignments(), mood()
+        )
+        return {
+            "job_categories": job_categories,
+            "mood_analysis": mood_analysis,
+            "job_insights": job_insights,
+        }
+
+    async def _ask_json(self, instructions, text, stage):
+        async def ask(client):
+            if client.json_mode:
+                client.set_system_message(instructions)
+                return await client.chat_async(text)
+            client.set_system_message(
+                f"{instructions}\n        Respond with only the JSON object and no other text."
+            )
+            # Parsed inside the request, so a reply without a JSON object is retried, not cached
+            client.reply_parser = parse_json_response
+            return await client.chat_async(text)
+
+        return await self.router.run(self.json_candidates, ask, self.session_id, stage)
+
+    async def _ask_tagged(self, instructions, text, response_model, stage, on_chunk=None):
+        async def ask(client):
+            if client.json_mode:
+                # Tags don't survive JSON mode, so the sections are asked for as the schema itself
+                client.set_system_message(
+                    f"{instructions}\n\n        Fill in every field of the response."
+                )
+                response = await client.chat_async(text, response_model=response_model)
+                return response.model_dump()
+            return await self._ask_tags(client, instructions, text, response_model, on_chunk)
+
+        return await self.router.run(
+            self.tagged_candidates, ask, self.session_id, stage
+        )
+
+    async def _ask_tags(self, client, instructions, text, response_model, on_chunk=None):
+        client.set_system_message(
+            f"""{instructions}
+
+        Respond in the following format:
+{tag_format(response_model)}
+        """
+        )
+        response = await client.chat_async(text, on_chunk=on_chunk)
+        parsed = parse_claude_response(response, list(response_model.model_fields))
+        try:
+            return response_model.model_validate(parsed).model_dump()
+        except ValidationError as e:
+            print(
+                f"Tagged response failed validation, asking again for this stage only: {e}"
+            )
+            # Re-ask on the same conversation with the error, as a schema-validated tool call
+            repaired = await client.chat_async(
+                f"Your answer could not be used because some sections were missing or malformed:\n{e}\n"
+                "Answer again with every section filled in.",
+                response_model=response_model,
+            )
+            return repaired.model_dump()
+
+    async def generate_career_path_analysis(self, user_input, skills, on_chunk=None):
+        return await self._ask_tagged(
+            CAREER_PATH_PROMPT,
+            f"""User Input: {user_input}
+        Skills: {skills}""",
+            CareerPathAnalysis,
+            "career_path_analysis",
+            on_chunk,
+        )
+
+    async def create_skill_development_plan(
+        self, career_goal, current_skills, on_chunk=None
+    ):
+        return await self._ask_tagged(
+            SKILL_PLAN_PROMPT,
+            f"""Career Goal: {career_goal}
+        Current Skills: {current_skills}""",
+            SkillDevelopmentPlan,
+            "skill_plan",
+            on_chunk,
+        )
+
+    async def forecast_industry_trends(self, user_input, job_categories, on_chunk=None):
+        return await self._ask_tagged(
+            INDUSTRY_FORECAST_PROMPT,
+            f"""User Input: {user_input}
+        Job Categories: {job_categories}""",
+            IndustryForecast,
+            "industry_forecast",
+            on_chunk,
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def tag_pattern(tag):
+    return re.compile(f"<{tag}>(.*?)</{tag}>", re.DOTALL)
+
+
+def tag_format(response_model):
+    # One line per section, e.g. <challenges>Potential obstacles ...</challenges>
+    return "\n".join(
+        f"        <{name}>{field.description}</{name}>"
+        for name, field in response_model.model_fields.items()
+    )
+
+
+def parse_json_response(response):
+    # Providers without a JSON mode may wrap the object in a code fence or a sentence
+    start, end = response.find("{"), response.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in response: {response[:200]!r}")
+    return json.loads(response[start : end + 1])
+
+
+def parse_claude_response(response, tags):
+    parsed = {}
+    for tag in tags:
+        match = tag_pattern(tag).search(response)
+        if match:
+            parsed[tag] = match.group(1).strip()
+    return parsed
+
+
+async def follow_up_chat(
+    question,
+    analysis_context,
+    chat_client,
+    max_context_tokens=CHAT_CONTEXT_TOKENS,
+    router=None,
+    fallbacks=(),
+):
+    # The system message only holds what stays the same for the whole chat, so with the
+    # history after it the prompt is a cacheable prefix. The excerpts matched to this question
+    # go with it as turn context, which isn't kept in the history
+    summary = f"Summary:\n{analysis_context.summary}"
+    system_message = f"""You are a career coach answering follow-up questions about the user's career analysis. Base your answers on this summary of it and the excerpts sent with each question:
+
+        {summary}
+
+        Provide concise and relevant answers."""
+    excerpts = analysis_context.excerpts(question, max_context_tokens - count_tokens(summary))
+    context = f"Relevant parts of the analysis:\n\n{excerpts}" if excerpts else None
+    if router is None:
+        chat_client.set_system_message(system_message)
+        return await chat_client.chat_async(question, context=context)
+
+    async def ask(client):
+        # Each candidate continues a copy of the session's conversation, which is replaced
+        # once a reply arrives, so a failed attempt leaves no dangling question behind
+        client.conversation = chat_client.conversation.copy()
+        client.summarizer = chat_client.summarizer
+        # Chat keeps its place ahead of the analysis stages on a fallback provider's scheduler
+        client.priority = chat_client.priority
+        client.set_system_message(system_message)
+        response = await client.chat_async(question, context=context)
+        chat_client.conversation = client.conversation
+        return response
+
+    return await router.run(
+        [chat_client, *fallbacks], ask, chat_client.session_id, chat_client.stage
+    )
+
+
+def _import_heavy_modules():
+    import pandas  # noqa: F401
+    import plotly.express  # noqa: F401
+
+    if not OFFLINE:
+        import anthropic  # noqa: F401
+        import openai  # noqa: F401
+    # Loads the tokenizer
+    count_tokens("")
+
+
+async def prewarm(clients=None):
+    """Loads what the first analysis would otherwise wait for: pandas and plotly, the SDKs,
+    the tokenizer, and the pooled async clients on the running loop."""
+    loop = asyncio.get_running_loop()
+    # Imports run on a worker thread so the loop keeps serving requests meanwhile
+    await loop.run_in_executor(None, _import_heavy_modules)
+    for client in clients or (openai_client, claude_client, gemini_client):
+        client.warm_up()
+
+
+_prewarm_future = None
+_prewarm_lock = threading.Lock()
+
+
+def start_prewarm(background_loop):
+    # Once per process: Streamlit reruns the app script, but imported modules are kept
+    global _prewarm_future
+    with _prewarm_lock:
+        if _prewarm_future is None:
+            _prewarm_future = background_loop.submit(prewarm())
+        return _prewarm_future
+
+
+# Sections of a finished analysis, in display order
+ANALYSIS_SECTIONS = [
+    "mood_analysis",
+    "job_insights",
+    "career_path_analysis",
+    "skill_plan",
+    "industry_forecast",
+]
+
+
+def build_analysis_graph(
+    assistant,
+    user_input,
+    skills,
+    max_concurrency=ANALYSIS_CONCURRENCY,
+    on_done=None,
+    on_chunk=None,
+    fused=FUSED_JSON_STAGES,
+):
+    # on_done and on_chunk map stage names to callbacks, so callers can show each
+    # stage as soon as it finishes or while its reply is still streaming
+    on_done = on_done or {}
+    on_chunk = on_chunk or {}
+
+    async def career_path_stage():
+        return await assistant.generate_career_path_analysis(
+            user_input, skills, on_chunk=on_chunk.get("career_path_analysis")
+        )
+
+    async def skill_plan_stage(job_categories):
+        top_career = job_categories.iloc[0]["job_title"]
+        return await assistant.create_skill_development_plan(
+            top_career, skills, on_chunk=on_chunk.get("skill_plan")
+        )
+
+    async def industry_forecast_stage(job_categories):
+        return await assistant.forecast_industry_trends(
+            user_input,
+            ", ".join(job_categories["job_title"].tolist()),
+            on_chunk=on_chunk.get("industry_forecast"),
+        )
+
+    graph = StageGraph(max_concurrency=max_concurrency)
+    if fused:
+        # One call answers all three JSON stages, which then just hand out their part
+        async def part(profile, name):
+            return profile[name]
+
+        graph.add_stage("profile", lambda: assistant.analyze_profile(user_input))
+        for name in FUSED_STAGES:
+            graph.add_stage(
+                name,
+                functools.partial(part, name=name),
+                inputs=["profile"],
+                on_done=on_done.get(name),
+            )
+    else:
+        graph.add_stage(
+            "job_categories",
+            lambda: assistant.update_job_categories(user_input),
+            on_done=on_done.get("job_categories"),
+        )
+        graph.add_stage(
+            "mood_analysis",
+            lambda: assistant.analyze_mood(user_input),
+            on_done=on_done.get("mood_analysis"),
+        )
+        graph.add_stage(
+            "job_insights",
+            lambda job_categories: assistant.analyze_job_market_alignment(user_input),
+            inputs=["job_categories"],
+            on_done=on_done.get("job_insights"),
+        )
+    graph.add_stage(
+        "career_path_analysis",
+        career_path_stage,
+        on_done=on_done.get("career_path_analysis"),
+    )
+    graph.add_stage(
+        "skill_plan",
+        skill_plan_stage,
+        inputs=["job_categories"],
+        on_done=on_done.get("skill_plan"),
+    )
+    graph.add_stage(
+        "industry_forecast",
+        industry_forecast_stage,
+        inputs=["job_categories"],
+        on_done=on_done.get("industry_forecast"),
+    )
+    return graph
+
+
+async def analyze(assistant, user_input, skills, **kwargs):
+    results = await build_analysis_graph(assistant, user_input, skills, **kwargs).run()
+    return {name: results[name] for name in ANALYSIS_SECTIONS}
+
+
+# Analyses run as jobs on the background loop, so a submit returns at once and the page polls
+# for progress. ANALYSIS_WORKERS caps how many run at the same time; the rest are queued.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "8"))
+analysis_jobs = JobQueue(get_background_loop, workers=ANALYSIS_WORKERS)
+
+
+async def analysis_job(job, assistant, user_input, skills):
+    # Each stage's output goes on the job when it finishes, and the tagged stages' text while
+    # it streams. The finished analysis is saved under the job's id.
+    started = time.time()
+    graph = build_analysis_graph(
+        assistant,
+        user_input,
+        skills,
+        on_done={
+            stage: functools.partial(job.add_result, stage)
+            for stage in ["job_categories", *ANALYSIS_SECTIONS]
+        },
+        on_chunk={
+            stage: functools.partial(job.add_text, stage)
+            for stage in ["career_path_analysis", "skill_plan", "industry_forecast"]
+        },
+    )
+    results = await graph.run()
+    save_analysis(
+        assistant,
+        user_input,
+        skills,
+        results,
+        timings=graph.timings,
+        since=started,
+        analysis_id=job.id,
+    )
+    return {name: results[name] for name in ANALYSIS_SECTIONS}
+
+
+def save_analysis(
+    assistant,
+    user_input,
+    skills,
+    results,
+    timings=None,
+    since=0.0,
+    analysis_id=None,
+    store=analysis_store,
+):
+    # The models come from this session's telemetry records made since the analysis started
+    models = telemetry.models_by_stage(assistant.session_id, since)
+    # A fused call is recorded as profile_analysis; a part asked for again keeps its own record
+    fused = models.pop("profile_analysis", None)
+    if fused is not None:
+        for name in FUSED_STAGES:
+            models.setdefault(name, fused)
+    return store.save(
+        {name: results[name] for name in ANALYSIS_SECTIONS},
+        user_input,
+        skills,
+        timings=timings,
+        models=models,
+        analysis_id=analysis_id,
+    )
+
+
+def title_case(name):
+    return name.replace("_", " ").title()
+
+
+def analysis_chunks(results):
+    chunks = []
+    for section in ANALYSIS_SECTIONS:
+        value = results.get(section) or {}
+        if section == "job_insights":
+            for alignment in value.get("alignments", []):
+                chunks.append(
+                    {
+                        "section": section,
+                        "title": f"Job Alignment - {alignment.get('job_title')}",
+                        "text": f"Score {alignment.get('score')}. {alignment.get('reason', '')}",
+                    }
+                )
+            continue
+        for field, text in value.items():
+            for piece in split_words(str(text), CHUNK_WORDS):
+                chunks.append(
+                    {
+                        "section": section,
+                        "title": f"{title_case(section)} - {title_case(field)}",
+                        "text": piece,
+                    }
+                )
+    return chunks
+
+
+def analysis_summary(results):
+    lines = []
+    mood = results.get("mood_analysis") or {}
+    if mood.get("sentiment"):
+        lines.append(f"Mood: {mood['sentiment']} (score {mood.get('score')})")
+    alignments = sorted(
+        (results.get("job_insights") or {}).get("alignments", []),
+        key=lambda x: x.get("score", 0),
+        reverse=True,
+    )
+    if alignments:
+        lines.append(
+            "Best aligned roles: "
+            + ", ".join(
+                f"{a.get('job_title')} ({a.get('score')})" for a in alignments[:3]
+            )
+        )
+    industries = (results.get("industry_forecast") or {}).get("industries")
+    if industries:
+        lines.append(f"Industries: {split_words(industries, 25)[0]}")
+    return "\n".join(lines)
+
+
+class AnalysisContext:
+    """Search index over one finished analysis, built once and queried per follow-up question."""
+
+    def __init__(self, results):
+        self.summary = analysis_summary(results)
+        self.index = BM25Index(analysis_chunks(results))
+
+    def excerpts(self, question, max_tokens, top_k=CHAT_CONTEXT_CHUNKS):
+        # The best matching excerpts, while they fit the budget
+        parts = []
+        used = 0
+        for _, chunk in self.index.search(question, top_k):
+            text = f"{chunk['title']}: {chunk['text']}"
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                break
+            parts.append(text)
+            used += tokens
+        return "\n\n".join(parts)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import deque
+
+from telemetry import percentile
+
+
+async def _first(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _rest(first, stream):
+    try:
+        if first is not None:
+            yield first
+            async for content in stream:
+                yield content
+    finally:
+        await stream.aclose()
+
+
+async def _discard(task, stream):
+    # Stops the losing request: its pending read is cancelled and its connection closed
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await stream.aclose()
+
+
+class HedgePolicy:
+    """Sends a backup request to another provider when the first token is late.
+
+    ``backup`` is a UnifiedApis instance for the second provider/model. The backup starts
+    once no first token has arrived after ``delay`` seconds, or by default after the rolling
+    ``quantile`` of recent first-token times. Whichever request streams first is used and
+    the other is cancelled.
+    """
+
+    def __init__(self, backup, delay=None, quantile=0.9, window=200, min_samples=20, initial_delay=3.0):
+        self.backup = backup
+        self.delay = delay
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.samples = deque(maxlen=window)
+        self.stats = {"requests": 0, "hedged": 0, "primary_wins": 0, "backup_wins": 0, "backup_failures": 0}
+
+    def threshold(self):
+        if self.delay is not None:
+            return self.delay
+        if len(self.samples) < self.min_samples:
+            return self.initial_delay
+        return percentile(self.samples, self.quantile)
+
+    def summary(self):
+        requests = self.stats["requests"]
+        hedged = self.stats["hedged"]
+        return {
+            **self.stats,
+            "hedge_rate": hedged / requests if requests else 0.0,
+            "backup_win_rate": self.stats["backup_wins"] / hedged if hedged else 0.0,
+            "threshold": self.threshold(),
+        }
+
+    async def race(self, primary, start_backup):
+        """Returns the content stream to use and which one won: ``primary``, or the stream
+        ``start_backup()`` opens if that one streams first. The winner is None when no backup was needed.
+        """
+        self.stats["requests"] += 1
+        start = time.monotonic()
+        primary_first = asyncio.ensure_future(_first(primary))
+        streams = {primary_first: primary}
+        try:
+            done, _ = await asyncio.wait({primary_first}, timeout=self.threshold())
+            if done:
+                # On time; a failure here goes to the normal retry handling
+                self.samples.append(time.monotonic() - start)
+                return _rest(primary_first.result(), primary), None
+
+            self.stats["hedged"] += 1
+            backup = start_backup()
+            backup_first = asyncio.ensure_future(_first(backup))
+            streams[backup_first] = backup
+            errors = []
+            pending = set(streams)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Checked in a fixed order so a tie goes to the primary
+                for task in (primary_first, backup_first):
+                    if task not in done:
+                        continue
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        if task is backup_first:
+                            self.stats["backup_failures"] += 1
+                        continue
+                    loser = backup_first if task is primary_first else primary_first
+                    await _discard(loser, streams[loser])
+                    # The primary's first token took at least this long, which keeps the window honest when it loses
+                    self.samples.append(time.monotonic() - start)
+                    winner = "primary" if task is primary_first else "backup"
+                    self.stats[f"{winner}_wins"] += 1
+                    return _rest(task.result(), streams[task]), winner
+            raise errors[0]
+        except asyncio.CancelledError:
+            for task, stream in streams.items():
+                await _discard(task, stream)
+            raise
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+import uuid
+
+
+class Job:
+    """One submitted run: its status, the stage outputs so far and the text streamed per stage.
+
+    Workers fill it in on the event loop while pages read it from their script threads, so
+    every read goes through ``snapshot``. A poller passes the same ``seen`` dict each time to
+    get only the text streamed since its last look.
+    """
+
+    def __init__(self, run):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._run = run
+        self._results = {}
+        self._text = {}
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def add_result(self, stage, result):
+        with self._lock:
+            self._results[stage] = result
+
+    def add_text(self, stage, chunk):
+        with self._lock:
+            self._text.setdefault(stage, []).append(chunk)
+
+    def snapshot(self, seen=None):
+        # seen maps each stage to the chunks already handed out; it is updated in place
+        with self._lock:
+            text = {}
+            for stage, chunks in self._text.items():
+                start = seen.get(stage, 0) if seen is not None else 0
+                text[stage] = "".join(chunks[start:])
+                if seen is not None:
+                    seen[stage] = len(chunks)
+            return {
+                "id": self.id,
+                "status": self.status,
+                "results": dict(self._results),
+                "text": text,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobQueue:
+    """Runs jobs on a fixed pool of workers on the background event loop.
+
+    ``submit`` takes a coroutine function called with the job and returns the job at once;
+    callers poll the job instead of waiting on it. It is meant for threads other than the
+    loop's own, such as Streamlit script threads. At most ``workers`` jobs run at a time, the
+    rest wait in order. Finished jobs are kept for ``keep_finished`` seconds, so a page that
+    polls late still finds the result.
+    """
+
+    def __init__(self, get_loop, workers=8, keep_finished=600):
+        self.get_loop = get_loop
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self._jobs = {}
+        self._tasks = {}
+        self._busy = 0
+        self._loop = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def submit(self, run):
+        job = Job(run)
+        loop = self._ensure_workers()
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+        loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id):
+        # Jobs queued ahead of this one, or None once it has started
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return None
+            return sum(
+                other.status == "queued" and other.created_at < job.created_at
+                for other in self._jobs.values()
+            )
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            if job.status == "queued":
+                # The worker skips it when it comes up
+                self._finish(job, "cancelled")
+                return
+            task = self._tasks.get(job_id)
+        if task is not None:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    def summary(self):
+        with self._lock:
+            queued = sum(job.status == "queued" for job in self._jobs.values())
+            return {
+                **self.stats,
+                "queued": queued,
+                "running": self._busy,
+                "workers": self.workers,
+                "utilization": self._busy / self.workers,
+            }
+
+    def _ensure_workers(self):
+        background_loop = self.get_loop()
+        with self._lock:
+            if self._loop is not background_loop.loop:
+                # First submit, or the background loop was replaced: jobs queued on the old
+                # one are gone with it
+                self._loop = background_loop.loop
+                self._queue = None
+                self._busy = 0
+                for job in self._jobs.values():
+                    if not job.finished:
+                        self._finish(job, "failed", "The worker loop stopped")
+                background_loop.run(self._start())
+        return self._loop
+
+    async def _start(self):
+        # The queue is created on the loop that serves it
+        self._queue = asyncio.Queue()
+        for _ in range(self.workers):
+            asyncio.ensure_future(self._worker())
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                task = asyncio.ensure_future(job._run(job))
+                self._tasks[job.id] = task
+                self._busy += 1
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    # The worker itself is being cancelled
+                    raise
+                self._done(job, "cancelled")
+            except Exception as e:
+                print("Error:", e)
+                self._done(job, "failed", str(e))
+            else:
+                job.result = result
+                self._done(job, "done")
+
+    def _done(self, job, status, error=None):
+        with self._lock:
+            self._tasks.pop(job.id, None)
+            self._busy -= 1
+            self._finish(job, status, error)
+
+    def _finish(self, job, status, error=None):
+        job.error = error
+        job.finished_at = time.time()
+        job.status = status
+        self.stats[status] += 1
+
+    def _expire(self):
+        cutoff = time.time() - self.keep_finished
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
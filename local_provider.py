@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Vocabulary for filler text; answers only need to look like prose, not mean anything
+WORDS = (
+    "career growth skills team project data product market role experience learning "
+    "impact strategy leadership design analysis planning communication industry trend "
+    "opportunity challenge mentor portfolio network certification remote hybrid demand "
+    "automation research customer platform cloud security startup enterprise focus"
+).split()
+
+JOB_TITLES = [
+    "Data Scientist",
+    "Software Engineer",
+    "Product Manager",
+    "UX Designer",
+    "Machine Learning Engineer",
+    "Business Analyst",
+    "Cloud Architect",
+]
+
+
+class LocalProviderError(Exception):
+    """Injected failure, shaped like the SDK errors so retries and the circuit breaker treat it the same."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Local provider injected error {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def _prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _filler(rng, words):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _from_schema(schema, rng, words, defs=None, name=""):
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _from_schema(defs[schema["$ref"].split("/")[-1]], rng, words, defs, name)
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return _from_schema(options[0] if options else {"type": "null"}, rng, words, defs, name)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return {
+            key: _from_schema(value, rng, words, defs, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [_from_schema(schema.get("items", {}), rng, words, defs, name) for _ in range(max(3, schema.get("minItems", 0)))]
+    if kind == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+    if kind == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 1)), 2)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "null":
+        return None
+    description = schema.get("description") or name.replace("_", " ")
+    return f"{description}: {_filler(rng, words)}"
+
+
+# Templates for the JSON prompts MindCareerAssistant sends, tried in order. Each is a
+# (pattern, builder) pair; builder(prompt, rng, words) returns the object to answer with.
+def _job_categories(prompt, rng, words):
+    titles = rng.sample(JOB_TITLES, 5)
+    return {title: round(rng.uniform(0.05, 0.4), 2) for title in titles}
+
+
+def _mood(prompt, rng, words):
+    return {
+        "sentiment": rng.choice(["Hopeful", "Anxious but motivated", "Neutral", "Frustrated"]),
+        "score": round(rng.uniform(-1, 1), 2),
+        "analysis": _filler(rng, words),
+        "career_impact": _filler(rng, words),
+    }
+
+
+def _alignments(prompt, rng, words):
+    match = re.search(r"(?i)job categories: (.*?)\.\s", prompt)
+    titles = [title.strip() for title in match.group(1).split(",")] if match else JOB_TITLES[:5]
+    return {
+        "alignments": [
+            {"job_title": title, "score": round(rng.uniform(0, 1), 2), "reason": _filler(rng, words // 3 or 1)}
+            for title in titles
+        ]
+    }
+
+
+def _profile(prompt, rng, words):
+    # The fused answer: categories, mood and one alignment per category
+    categories = _job_categories(prompt, rng, words)
+    return {
+        "job_categories": categories,
+        "mood_analysis": _mood(prompt, rng, words),
+        "alignments": [
+            {"job_title": title, "score": round(rng.uniform(0, 1), 2), "reason": _filler(rng, words // 3 or 1)}
+            for title in categories
+        ],
+    }
+
+
+JSON_TEMPLATES = [
+    (re.compile(r'"job_categories"'), _profile),
+    (re.compile(r"job categories and their estimated growth rates"), _job_categories),
+    (re.compile(r"sentiment of the"), _mood),
+    (re.compile(r'"alignments"'), _alignments),
+]
+
+
+def register_template(pattern, builder):
+    # Lets other apps teach the local provider the shape of their JSON prompts
+    JSON_TEMPLATES.insert(0, (re.compile(pattern), builder))
+
+
+def _json_answer(prompt, rng, words):
+    for pattern, builder in JSON_TEMPLATES:
+        if pattern.search(prompt):
+            return builder(prompt, rng, words)
+    # Unknown prompt: fill every "key": that appears in it
+    keys = list(dict.fromkeys(re.findall(r'"(\w+)"\s*:', prompt))) or ["answer"]
+    return {key: _filler(rng, words) for key in keys}
+
+
+def generate_reply(messages, response_format=None, rng=None, words=60):
+    """Builds a deterministic answer for a chat request.
+
+    JSON schemas are filled field by field, json_object requests use the templates above,
+    prompts that ask for ``<tag>...</tag>`` sections get every section, and anything else
+    gets plain text.
+    """
+    rng = rng or random.Random(0)
+    # The instructions are in the system message and the text they apply to in the last one
+    system = [message for message in messages[:1] if message["role"] == "system"]
+    last = _prompt_text(system + messages[-1:]) if messages else ""
+    if response_format and response_format.get("type") == "json_schema":
+        return json.dumps(_from_schema(response_format["json_schema"]["schema"], rng, words))
+    if response_format and response_format.get("type") == "json_object":
+        return json.dumps(_json_answer(last, rng, words))
+    tags = [tag for tag in dict.fromkeys(re.findall(r"<(\w+)>", last)) if f"</{tag}>" in last]
+    if tags:
+        return "\n".join(f"<{tag}>{_filler(rng, words)}</{tag}>" for tag in tags)
+    return _filler(rng, words)
+
+
+def _split_tokens(text):
+    # Words with their trailing whitespace, so joining the chunks gives back the text
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def _usage(messages, reply):
+    prompt_tokens = (len(_prompt_text(messages)) + 3) // 4
+    completion_tokens = (len(reply) + 3) // 4
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+
+
+def _completion(model, reply, usage):
+    message = SimpleNamespace(role="assistant", content=reply, parsed=None)
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        usage=usage,
+    )
+
+
+def _chunk(model, content, finish_reason=None):
+    delta = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta, finish_reason=finish_reason)])
+
+
+def _usage_chunk(model, usage):
+    # Like the OpenAI API with stream_options.include_usage: no choices, only usage
+    return SimpleNamespace(model=model, choices=[], usage=usage)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class _LocalCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, messages, stream=False, max_tokens=None, response_format=None, stream_options=None, **kwargs):
+        include_usage = bool(stream_options and stream_options.get("include_usage"))
+        return self._client._create(model, messages, stream, max_tokens, response_format, include_usage)
+
+
+class LocalClient:
+    """Offline stand-in for the OpenAI SDK client, for load tests without network or API keys.
+
+    Answers are derived from a hash of the request, so the same request always gets the
+    same answer. ``ttft`` is the delay before the first token, ``tokens_per_second`` the
+    streaming speed (0 means instant) and ``error_rate`` the fraction of calls that fail
+    with ``error_status``. Defaults come from the LOCAL_TTFT, LOCAL_TOKENS_PER_SECOND,
+    LOCAL_ERROR_RATE and LOCAL_SEED environment variables.
+    """
+
+    def __init__(self, ttft=None, tokens_per_second=None, error_rate=None, error_status=503, seed=None, words=60):
+        self.ttft = ttft if ttft is not None else _env_float("LOCAL_TTFT", 0.0)
+        self.tokens_per_second = tokens_per_second if tokens_per_second is not None else _env_float("LOCAL_TOKENS_PER_SECOND", 0.0)
+        self.error_rate = error_rate if error_rate is not None else _env_float("LOCAL_ERROR_RATE", 0.0)
+        self.error_status = error_status
+        self.seed = seed if seed is not None else int(_env_float("LOCAL_SEED", 0))
+        self.words = words
+        self.calls = 0
+        self.errors = 0
+        # Failed attempts per request, so a retried request can succeed where the first try failed.
+        # Entries go once the request succeeds; the oldest go beyond max_tracked requests.
+        self._attempts = OrderedDict()
+        self.max_tracked = 10000
+        self.chat = SimpleNamespace(completions=_LocalCompletions(self))
+
+    def _rng(self, model, messages, response_format):
+        request = json.dumps([model, messages, response_format], sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{self.seed}:{request}".encode("utf-8")).hexdigest()
+        attempt = self._attempts.get(digest, 0)
+        # The answer depends only on the request; whether this attempt fails also depends on the attempt number
+        return digest, random.Random(digest), random.Random(f"{digest}:{attempt}")
+
+    def _prepare(self, model, messages, max_tokens, response_format):
+        self.calls += 1
+        digest, reply_rng, error_rng = self._rng(model, messages, response_format)
+        if self.error_rate and error_rng.random() < self.error_rate:
+            self.errors += 1
+            self._attempts[digest] = self._attempts.get(digest, 0) + 1
+            self._attempts.move_to_end(digest)
+            while len(self._attempts) > self.max_tracked:
+                self._attempts.popitem(last=False)
+            raise LocalProviderError(self.error_status)
+        self._attempts.pop(digest, None)
+        reply = generate_reply(messages, response_format, reply_rng, self.words)
+        tokens = _split_tokens(reply)
+        if max_tokens and len(tokens) > max_tokens and not response_format:
+            tokens = tokens[:max_tokens]
+            reply = "".join(tokens)
+        return reply, tokens
+
+    def _delays(self, tokens):
+        # Seconds from the request until each token is due
+        per_token = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+        return [self.ttft + i * per_token for i in range(len(tokens))]
+
+    def _create(self, model, messages, stream, max_tokens, response_format, include_usage=False):
+        start = time.monotonic()
+        reply, tokens = self._prepare(model, messages, max_tokens, response_format)
+        usage = _usage(messages, reply)
+        if not stream:
+            time.sleep(self._delays(tokens)[-1] if tokens else self.ttft)
+            return _completion(model, reply, usage)
+
+        def chunks():
+            for token, due in zip(tokens, self._delays(tokens)):
+                wait = start + due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                yield _chunk(model, token)
+            yield _chunk(model, None, "stop")
+            if include_usage:
+                yield _usage_chunk(model, usage)
+
+        return chunks()
+
+
+class _AsyncLocalCompletions(_LocalCompletions):
+    async def create(self, model, messages, stream=False, max_tokens=None, response_format=None, stream_options=None, **kwargs):
+        include_usage = bool(stream_options and stream_options.get("include_usage"))
+        return await self._client._create_async(model, messages, stream, max_tokens, response_format, include_usage)
+
+
+class AsyncLocalClient(LocalClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat = SimpleNamespace(completions=_AsyncLocalCompletions(self))
+
+    async def _create_async(self, model, messages, stream, max_tokens, response_format, include_usage=False):
+        start = time.monotonic()
+        reply, tokens = self._prepare(model, messages, max_tokens, response_format)
+        usage = _usage(messages, reply)
+        if not stream:
+            await asyncio.sleep(self._delays(tokens)[-1] if tokens else self.ttft)
+            return _completion(model, reply, usage)
+
+        async def chunks():
+            for token, due in zip(tokens, self._delays(tokens)):
+                wait = start + due - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                yield _chunk(model, token)
+            yield _chunk(model, None, "stop")
+            if include_usage:
+                yield _usage_chunk(model, usage)
+
+        return chunks()
@@ -1,195 +1,38 @@
 import streamlit as st
-import pandas as pd
-from unified import UnifiedApis
-import asyncio
-import re
-import plotly.express as px
-
-
-# Initialize the UnifiedApis clients once at the module level
-openai_client = UnifiedApis(
-    provider="openai", model="gpt-4o", use_async=True, json_mode=True
-)
-
-claude_client = UnifiedApis(
-    provider="anthropic", model="claude-3-5-sonnet-20240620", use_async=True
-)
-
-gemini_client = UnifiedApis(
-    provider="openrouter", model="google/gemini-pro-1.5", use_async=True
+from career_assistant import (
+    CAREER_PATH_TAGS,
+    INDUSTRY_FORECAST_TAGS,
+    SKILL_PLAN_TAGS,
+    AnalysisContext,
+    MindCareerAssistant,
+    analysis_job,
+    analysis_jobs,
+    analysis_store,
+    chat_summarizer,
+    follow_up_chat,
+    render_cache,
+    router,
+    start_prewarm,
+    telemetry,
 )
+from background_loop import get_background_loop
+from scheduler import scheduler_stats
+from tag_stream import TagStreamParser
+import functools
+import os
 
+# pandas and plotly are imported inside the functions that draw with them: the first page
+# is only the input form, and start_prewarm loads them in the background once it is shown.
 
-class MindCareerAssistant:
-    def __init__(self):
-        self.job_market_data = pd.DataFrame(
-            {
-                "job_title": [
-                    "Data Scientist",
-                    "Software Engineer",
-                    "Product Manager",
-                    "UX Designer",
-                ],
-                "growth_rate": [0.3, 0.25, 0.2, 0.22],
-            }
-        )
-
-    async def update_job_categories(self, query):
-        response = await openai_client.chat_async(
-            f"""Based on the following text, suggest at least 5 relevant job categories and their estimated growth rates. 
-        If the text suggests fewer than 5 categories, add related or complementary job categories to reach a total of 5.
-        Return the result as a JSON object where keys are job titles and values are growth rates (as decimals, e.g., 0.25 for 25% growth).
-        Text: '{query}'"""
-        )
-
-        if isinstance(response, dict) and len(response) >= 5:
-            new_job_data = [
-                {"job_title": title, "growth_rate": rate}
-                for title, rate in response.items()
-            ]
-        else:
-            print(
-                f"Unexpected response format or insufficient job categories: {response}"
-            )
-            # Fallback to ensure at least 5 job categories
-            default_categories = [
-                "Data Scientist",
-                "Software Engineer",
-                "Product Manager",
-                "UX Designer",
-                "Marketing Specialist",
-            ]
-            new_job_data = [
-                {"job_title": title, "growth_rate": 0.2} for title in default_categories
-            ]
-
-        self.job_market_data = pd.DataFrame(new_job_data)
-
-        # Ensure we have exactly 5 categories
-        if len(self.job_market_data) > 5:
-            self.job_market_data = self.job_market_data.nlargest(5, "growth_rate")
-        elif len(self.job_market_data) < 5:
-            additional_categories = [
-                {"job_title": f"Additional Category {i}", "growth_rate": 0.1}
-                for i in range(5 - len(self.job_market_data))
-            ]
-            self.job_market_data = pd.concat(
-                [self.job_market_data, pd.DataFrame(additional_categories)]
-            )
-
-    async def analyze_mood(self, text):
-        return await openai_client.chat_async(
-            f"""Analyze the sentiment of the following text. Return the result in the following JSON format:
-        {{
-            "sentiment": "Brief description of the sentiment",
-            "score": A number between -1 (very negative) and 1 (very positive),
-            "analysis": "Detailed analysis of the person's mood and emotional state",
-            "career_impact": "How this emotional state might affect career decisions or performance"
-        }}
-        Text: {text}"""
-        )
-
-    async def analyze_job_market_alignment(self, user_input):
-        job_categories = ", ".join(self.job_market_data["job_title"].tolist())
-        response = await openai_client.chat_async(
-            f"""Analyze how well the given text aligns with these job categories: {job_categories}. Return the result in the following JSON format:
-        {{
-            "alignments": [
-                {{
-                    "job_title": "Job title",
-                    "score": A number between 0 and 1 indicating alignment,
-                    "reason": "Brief explanation of the alignment score"
-                }},
-                ...
-            ]
-        }}
-        Text to analyze: '{user_input}'"""
-        )
-
-        # Add error handling and logging
-        if not isinstance(response, dict) or "alignments" not in response:
-            print(f"Unexpected response format: {response}")
-            return {"alignments": []}
-
-        return response
-
-    async def generate_career_path_analysis(self, user_input, skills):
-        response = await claude_client.chat_async(
-            f"""Based on the following user input and skills, provide a detailed career path analysis. Consider both short-term and long-term career prospects, potential challenges, and areas for growth.
-
-        User Input: {user_input}
-        Skills: {skills}
 
-        Respond in the following format:
-        <short_term_prospects>Analysis of immediate career opportunities</short_term_prospects>
-        <long_term_prospects>Potential career trajectory over the next 5-10 years</long_term_prospects>
-        <challenges>Potential obstacles or challenges in this career path</challenges>
-        <growth_areas>Key areas for skill development and personal growth</growth_areas>
-        """
-        )
-        return response
-
-    async def create_skill_development_plan(self, career_goal, current_skills):
-        response = await claude_client.chat_async(
-            f"""Create a personalized skill development plan for someone aiming to become a {career_goal}. Consider their current skills and suggest a roadmap for acquiring new skills or improving existing ones.
+# ADMIN_PANEL=1 shows per-stage latency and token usage in the sidebar
+ADMIN_PANEL = os.getenv("ADMIN_PANEL") == "1"
 
-        Current Skills: {current_skills}
-
-        Provide your response in the following format:
-        <core_skills>List of essential skills for this career path</core_skills>
-        <skill_gaps>Identification of skills the person needs to develop</skill_gaps>
-        <learning_resources>Suggested courses, books, or online resources for skill development</learning_resources>
-        <timeline>Proposed timeline for skill acquisition (e.g., 3 months, 6 months, 1 year goals)</timeline>
-        """
-        )
-        return response
-
-    async def forecast_industry_trends(self, user_input, job_categories):
-        response = await claude_client.chat_async(
-            f"""Based on the following user input and job categories, forecast key trends and developments in the relevant industries over the next 5 years. Consider technological advancements, market shifts, and potential disruptions.
-
-        User Input: {user_input}
-        Job Categories: {job_categories}
-
-        Provide your response in the following format:
-        <industries>List the main industries relevant to the user's input and job categories</industries>
-        <technological_trends>Key technological advancements expected in these industries</technological_trends>
-        <market_shifts>Predicted changes in market dynamics or consumer behavior</market_shifts>
-        <potential_disruptions>Possible disruptive forces or game-changing innovations</potential_disruptions>
-        <career_implications>How these trends might affect career opportunities in the identified industries</career_implications>
-        """
-        )
-        return response
 
+# Seconds between two looks at a running analysis job
+JOB_POLL_INTERVAL = 0.5
 
-def parse_claude_response(response, tags):
-    parsed = {}
-    for tag in tags:
-        pattern = f"<{tag}>(.*?)</{tag}>"
-        match = re.search(pattern, response, re.DOTALL)
-        if match:
-            parsed[tag] = match.group(1).strip()
-    return parsed
-
-
-async def follow_up_chat(question, context):
-    response = await gemini_client.chat_async(
-        f"""Based on the following context, please answer the user's question:
-
-        Context: {context}
-
-        User's question: {question}
-
-        Provide a concise and relevant answer."""
-    )
-    return response
-
-
-async def run_analysis(assistant, user_input, skills):
-    await assistant.update_job_categories(user_input)
-
-    # Mood Analysis
-    mood_analysis = await assistant.analyze_mood(user_input)
+def render_mood_analysis(mood_analysis, expanded=False):
     st.header("Mood Analysis")
     col1, col2 = st.columns(2)
     with col1:
@@ -200,87 +43,76 @@ async def run_analysis(assistant, user_input, skills):
             text=f"Score: {mood_analysis['score']:.2f}",
         )
 
-    with st.expander("Detailed Mood Analysis"):
+    with st.expander("Detailed Mood Analysis", expanded=expanded):
         st.write(f"Analysis: {mood_analysis['analysis']}")
         st.write(f"Career Impact: {mood_analysis['career_impact']}")
 
-    # Job Market Alignment
-    job_insights = await assistant.analyze_job_market_alignment(user_input)
+
+def top_alignments_chart(alignments):
+    import plotly.express as px
+
+    return px.bar(
+        x=[a["job_title"] for a in alignments],
+        y=[a["score"] for a in alignments],
+        labels={"x": "Job Title", "y": "Alignment Score"},
+        title=f"Top {len(alignments)} Job Category Alignments",
+    )
+
+
+def top_alignments(job_insights, count=5):
+    return sorted(job_insights["alignments"], key=lambda x: x["score"], reverse=True)[
+        :count
+    ]
+
+
+def render_job_insights(job_insights, expanded=False, chart=None, top=None):
     st.header("Job Market Alignment")
 
     # Create a bar chart for job alignments
-    alignments = sorted(
-        job_insights["alignments"], key=lambda x: x["score"], reverse=True
-    )
-    top_5_alignments = alignments[:5]
+    top_5_alignments = top_alignments(job_insights) if top is None else top
 
     if not top_5_alignments:
         st.write("No job alignments found.")
     else:
-        fig = px.bar(
-            x=[a["job_title"] for a in top_5_alignments],
-            y=[a["score"] for a in top_5_alignments],
-            labels={"x": "Job Title", "y": "Alignment Score"},
-            title=f"Top {len(top_5_alignments)} Job Category Alignments",
-        )
-        st.plotly_chart(fig)
+        st.plotly_chart(chart or top_alignments_chart(top_5_alignments))
 
-    with st.expander("Alignment Details"):
+    with st.expander("Alignment Details", expanded=expanded):
         for alignment in top_5_alignments:
             st.write(f"- {alignment['job_title']}: {alignment['score']:.2f}")
             st.write(f"  Reason: {alignment['reason']}")
 
-    # Career Path Analysis
-    career_path_analysis = await assistant.generate_career_path_analysis(
-        user_input, skills
-    )
-    parsed_career_analysis = parse_claude_response(
-        career_path_analysis,
-        ["short_term_prospects", "long_term_prospects", "challenges", "growth_areas"],
-    )
+
+def career_path_layout(expanded=False):
     st.header("Career Path Analysis")
 
-    for key, value in parsed_career_analysis.items():
-        with st.expander(key.replace("_", " ").title()):
-            st.write(value)
+    placeholders = {}
+    for key in CAREER_PATH_TAGS:
+        with st.expander(key.replace("_", " ").title(), expanded=expanded):
+            placeholders[key] = st.empty()
+    return placeholders
 
-    # Skill Development Plan
-    top_career = assistant.job_market_data.iloc[0]["job_title"]
-    skill_plan = await assistant.create_skill_development_plan(top_career, skills)
-    parsed_skill_plan = parse_claude_response(
-        skill_plan, ["core_skills", "skill_gaps", "learning_resources", "timeline"]
-    )
+
+def skill_plan_layout(expanded=False):
     st.header("Skill Development Plan")
 
+    placeholders = {}
     col1, col2 = st.columns(2)
     with col1:
-        with st.expander("Core Skills"):
-            st.write(parsed_skill_plan["core_skills"])
+        with st.expander("Core Skills", expanded=expanded):
+            placeholders["core_skills"] = st.empty()
     with col2:
-        with st.expander("Skill Gaps"):
-            st.write(parsed_skill_plan["skill_gaps"])
+        with st.expander("Skill Gaps", expanded=expanded):
+            placeholders["skill_gaps"] = st.empty()
 
-    with st.expander("Learning Resources"):
-        st.write(parsed_skill_plan["learning_resources"])
+    with st.expander("Learning Resources", expanded=expanded):
+        placeholders["learning_resources"] = st.empty()
 
-    with st.expander("Timeline"):
-        st.write(parsed_skill_plan["timeline"])
+    with st.expander("Timeline", expanded=expanded):
+        placeholders["timeline"] = st.empty()
+    return placeholders
 
-    # Industry Forecast
-    job_categories = ", ".join(assistant.job_market_data["job_title"].tolist())
-    industry_forecast = await assistant.forecast_industry_trends(
-        user_input, job_categories
-    )
-    parsed_forecast = parse_claude_response(
-        industry_forecast,
-        [
-            "industries",
-            "technological_trends",
-            "market_shifts",
-            "potential_disruptions",
-            "career_implications",
-        ],
-    )
+
+def industry_forecast_layout(expanded=False):
     st.header("Industry Forecast")
 
     tabs = st.tabs(
@@ -292,14 +124,75 @@ async def run_analysis(assistant, user_input, skills):
             "Career Implications",
         ]
     )
-    for tab, (key, value) in zip(tabs, parsed_forecast.items()):
+    placeholders = {}
+    for tab, key in zip(tabs, INDUSTRY_FORECAST_TAGS):
         with tab:
-            st.write(value)
-
-    # Job Market Data Visualization
-    st.header("Job Market Overview")
-    fig = px.scatter(
-        assistant.job_market_data,
+            placeholders[key] = st.empty()
+    return placeholders
+
+
+def render_tagged_section(layout, values, expanded=False):
+    placeholders = layout(expanded=expanded)
+    for key, value in values.items():
+        placeholders[key].write(value)
+
+
+# Tagged sections with their layout and tags, to draw them from text that is still streaming
+TAGGED_SECTIONS = {
+    "career_path_analysis": (career_path_layout, CAREER_PATH_TAGS),
+    "skill_plan": (skill_plan_layout, SKILL_PLAN_TAGS),
+    "industry_forecast": (industry_forecast_layout, INDUSTRY_FORECAST_TAGS),
+}
+
+
+def job_progress(job_id):
+    # Kept across polls of one job: how much streamed text the section parsers have seen,
+    # the parsers themselves and the figures of the stages that have finished
+    progress = st.session_state.get("job_progress")
+    if progress is None or progress["job_id"] != job_id:
+        progress = {
+            "job_id": job_id,
+            "seen": {},
+            "parsers": {name: TagStreamParser(tags) for name, (_, tags) in TAGGED_SECTIONS.items()},
+            "figures": {},
+        }
+        st.session_state.job_progress = progress
+    return progress
+
+
+def render_analysis_progress(snapshot, progress):
+    # Draws what a running analysis job has produced so far, in page order. The snapshot
+    # holds only the text streamed since the last poll, which goes to the job's parsers
+    results = snapshot["results"]
+    figures = progress["figures"]
+    if "mood_analysis" in results:
+        render_mood_analysis(results["mood_analysis"])
+    if "job_insights" in results:
+        if "top_alignments" not in figures:
+            top = top_alignments(results["job_insights"])
+            figures["top_alignments"] = top_alignments_chart(top) if top else None
+        render_job_insights(results["job_insights"], chart=figures["top_alignments"])
+    for name, (layout, _) in TAGGED_SECTIONS.items():
+        if name in results:
+            render_tagged_section(layout, results[name])
+            continue
+        parser = progress["parsers"][name]
+        if snapshot["text"].get(name):
+            parser.feed(snapshot["text"][name])
+        sections = parser.result()
+        if sections:
+            render_tagged_section(layout, sections)
+    if "job_categories" in results:
+        if "job_growth_rates" not in figures:
+            figures["job_growth_rates"] = job_growth_chart(results["job_categories"])
+        render_job_growth_rates(results["job_categories"], chart=figures["job_growth_rates"])
+
+
+def job_growth_chart(job_market_data):
+    import plotly.express as px
+
+    return px.scatter(
+        job_market_data,
         x="job_title",
         y="growth_rate",
         size="growth_rate",
@@ -307,16 +200,11 @@ async def run_analysis(assistant, user_input, skills):
         title="Job Growth Rates",
         labels={"growth_rate": "Growth Rate", "job_title": "Job Title"},
     )
-    st.plotly_chart(fig)
 
-    # Return analysis results for follow-up chat
-    return {
-        "mood_analysis": mood_analysis,
-        "job_insights": job_insights,
-        "career_path_analysis": parsed_career_analysis,
-        "skill_plan": parsed_skill_plan,
-        "industry_forecast": parsed_forecast,
-    }
+
+def render_job_growth_rates(job_market_data, chart=None):
+    st.header("Job Market Overview")
+    st.plotly_chart(chart or job_growth_chart(job_market_data))
 
 
 def update_session_state():
@@ -357,21 +245,48 @@ def main():
     if "assistant" not in st.session_state:
         st.session_state.assistant = MindCareerAssistant()
 
+    if "analysis_id" not in st.session_state:
+        st.session_state.analysis_id = None
+    if "job_id" not in st.session_state:
+        st.session_state.job_id = None
+
+    # A shared link (?analysis=<id>) reopens a stored analysis without running it again
+    shared_id = st.query_params.get("analysis")
+    if shared_id and shared_id != st.session_state.analysis_id:
+        stored = analysis_store.load(shared_id)
+        if stored is not None:
+            show_analysis(stored["id"], stored["results"])
+        else:
+            del st.query_params["analysis"]
+            st.warning("That analysis is no longer available.")
+
     # Main content area
-    if not st.session_state.analysis_complete:
+    if st.session_state.job_id:
+        analysis_progress()
+        if st.button("Cancel"):
+            reset_session_state()
+            st.rerun()
+    elif not st.session_state.analysis_complete:
+        if st.session_state.get("job_error"):
+            st.error(f"Analysis failed: {st.session_state.pop('job_error')}")
         display_input_form()
     else:
         results_container = st.container()
         with results_container:
             st.markdown('<div class="fixed-height">', unsafe_allow_html=True)
-            display_analysis_results(st.session_state.analysis_results)
+            display_analysis_results(
+                st.session_state.analysis_results, st.session_state.analysis_id
+            )
             st.markdown("</div>", unsafe_allow_html=True)
 
         col1, col2 = st.columns([1, 3])
         if col1.button("Start Over"):
             reset_session_state()
             st.rerun()
-        col2.info("You can ask follow-up questions in the sidebar chat!")
+        col2.info(
+            "You can ask follow-up questions in the sidebar chat! "
+            "This page's link reopens this analysis."
+        )
 
     # Sidebar chat
     with st.sidebar:
@@ -380,27 +295,115 @@ def main():
         if not st.session_state.analysis_complete:
             st.info("Please complete the analysis to enable the chat feature.")
         else:
-            # Chat input and send button (moved to the top)
-            prompt = st.text_input("Ask a follow-up question:", key="chat_input")
-            if st.button("Send"):
-                if prompt:
-                    st.session_state.messages.append(
-                        {"role": "user", "content": prompt}
+            follow_up_chat_panel()
+
+        if ADMIN_PANEL:
+            render_admin_panel()
+
+    # The page has been sent by now; the heavy imports and SDK clients load while the user types
+    start_prewarm(get_background_loop())
+
+
+@st.fragment
+def follow_up_chat_panel():
+    # A fragment: typing a question or pressing Send reruns only this panel, not the analysis page
+
+    # Chat input and send button (moved to the top)
+    prompt = st.text_input("Ask a follow-up question:", key="chat_input")
+    if st.button("Send"):
+        if prompt:
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            with st.spinner("Processing your question..."):
+                # Indexed once per analysis, then searched for every question
+                if st.session_state.get("analysis_context") is None:
+                    st.session_state.analysis_context = AnalysisContext(
+                        st.session_state.analysis_results
                     )
-                    with st.spinner("Processing your question..."):
-                        context = str(st.session_state.analysis_results)
-                        response = asyncio.run(follow_up_chat(prompt, context))
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": response}
+                response = get_background_loop().run(
+                    follow_up_chat(
+                        prompt,
+                        st.session_state.analysis_context,
+                        st.session_state.assistant.chat_client,
+                        router=st.session_state.assistant.router,
+                        fallbacks=st.session_state.assistant.chat_fallbacks,
                     )
-                    st.rerun()
-
-            # Chat display (moved to the bottom)
-            chat_container = st.container()
-            with chat_container:
-                for message in st.session_state.messages:
-                    with st.chat_message(message["role"]):
-                        st.markdown(message["content"])
+                )
+            st.session_state.messages.append({"role": "assistant", "content": response})
+
+    # Chat display (moved to the bottom), drawn after the new messages were added
+    chat_container = st.container()
+    with chat_container:
+        for message in st.session_state.messages:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+
+def render_admin_panel():
+    import pandas as pd
+
+    with st.expander("Admin: LLM calls per stage"):
+        rows = telemetry.summary()
+        if not rows:
+            st.write("No calls recorded yet.")
+            return
+        columns = [
+            "stage",
+            "calls",
+            "errors",
+            "cache_hits",
+            "coalesced",
+            "hedged",
+            "hedge_backup_wins",
+            "retries",
+            "duration_p50",
+            "duration_p95",
+            "ttft_p50",
+            "ttft_p95",
+            "queue_wait_p95",
+            "input_tokens",
+            "output_tokens",
+            "cache_read_tokens",
+            "cache_write_tokens",
+            "cache_read_ratio",
+            "cache_write_ratio",
+        ]
+        st.dataframe(pd.DataFrame(rows)[columns], hide_index=True)
+        st.caption(
+            "Render cache: {entries} analyses, {hits} hits, {misses} misses".format(
+                **render_cache.stats()
+            )
+        )
+        st.caption(
+            "Analysis store: {analyses} analyses, {stages} stage outputs".format(
+                **analysis_store.stats()
+            )
+        )
+        st.caption(
+            "Analysis jobs: {queued} queued, {running} running on {workers} workers "
+            "({utilization:.0%} busy), {done} done, {failed} failed".format(
+                **analysis_jobs.summary()
+            )
+        )
+        if chat_summarizer is not None:
+            st.caption(
+                "Chat summaries: {compactions} compactions, {folded_messages} messages folded, {failures} failures".format(
+                    **chat_summarizer.stats
+                )
+            )
+        st.caption(
+            "Routing: {routed} routed, {rerouted} rerouted, {failovers} failovers".format(
+                **router.stats
+            )
+        )
+        st.dataframe(pd.DataFrame(router.summary()), hide_index=True)
+        st.caption("Schedulers: queued and in-flight requests, and how long they waited for a slot")
+        st.dataframe(pd.DataFrame(scheduler_stats()), hide_index=True)
+        st.download_button(
+            "Download Prometheus metrics",
+            telemetry.prometheus(),
+            file_name="metrics.prom",
+            mime="text/plain",
+        )
 
 
 def display_input_form():
@@ -432,127 +435,136 @@ def display_input_form():
     if submit_button:
         st.session_state.user_input = user_input
         st.session_state.skills = skills
-        with st.spinner("Analyzing your input..."):
-            analysis_results = asyncio.run(
-                run_analysis(
-                    st.session_state.assistant,
-                    st.session_state.user_input,
-                    st.session_state.skills,
-                )
+        # The same profile was analysed before: reopen that analysis instead
+        stored_id = analysis_store.find(user_input, skills)
+        stored = analysis_store.load(stored_id) if stored_id else None
+        if stored is not None:
+            show_analysis(stored["id"], stored["results"])
+            st.rerun()
+
+        # The analysis runs as a job on the app's long-lived event loop, so this script
+        # thread is free again right away; the page polls the job for progress
+        job = analysis_jobs.submit(
+            functools.partial(
+                analysis_job,
+                assistant=st.session_state.assistant,
+                user_input=user_input,
+                skills=skills,
             )
-            st.session_state.analysis_results = analysis_results
-            st.session_state.analysis_complete = True
+        )
+        st.session_state.job_id = job.id
+        st.rerun()
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def analysis_progress():
+    job = analysis_jobs.get(st.session_state.job_id)
+    if job is None:
+        # Expired, or lost with a restarted event loop
+        st.session_state.job_id = None
+        st.session_state.job_error = "The analysis was interrupted."
         st.rerun()
+    progress = job_progress(job.id)
+    snapshot = job.snapshot(seen=progress["seen"])
+    if snapshot["status"] in ("done", "failed", "cancelled"):
+        st.session_state.job_progress = None
+    if snapshot["status"] == "done":
+        st.session_state.job_id = None
+        show_analysis(job.id, snapshot["result"])
+        st.rerun()
+    if snapshot["status"] in ("failed", "cancelled"):
+        st.session_state.job_id = None
+        st.session_state.job_error = snapshot["error"] or "The analysis was cancelled."
+        st.rerun()
+    # None once a worker has picked the job up since the snapshot
+    ahead = analysis_jobs.position(job.id) if snapshot["status"] == "queued" else None
+    if ahead is not None:
+        st.info(f"Waiting for a free worker, {ahead} analyses ahead...")
+    else:
+        st.info("Analyzing your input...")
+    render_analysis_progress(snapshot, progress)
+
+
+def show_analysis(analysis_id, results):
+    # Makes this analysis the one on the page and in the URL; the chat starts over with it
+    st.session_state.analysis_id = analysis_id
+    st.session_state.analysis_results = results
+    st.session_state.analysis_context = None
+    st.session_state.messages = []
+    st.session_state.analysis_complete = True
+    st.query_params["analysis"] = analysis_id
 
 
 def reset_session_state():
+    if st.session_state.get("job_id"):
+        analysis_jobs.cancel(st.session_state.job_id)
+    st.session_state.job_id = None
+    st.session_state.job_progress = None
+    if st.session_state.get("analysis_id"):
+        render_cache.discard(st.session_state.analysis_id)
+    st.session_state.analysis_id = None
+    if "analysis" in st.query_params:
+        del st.query_params["analysis"]
     st.session_state.analysis_complete = False
     st.session_state.analysis_results = None
+    st.session_state.analysis_context = None
     st.session_state.messages = []
     st.session_state.user_input = ""
     st.session_state.skills = ""
     st.session_state.assistant = MindCareerAssistant()
 
 
-def display_analysis_results(results):
-    # Mood Analysis
-    st.header("Mood Analysis")
-    mood_analysis = results["mood_analysis"]
-    col1, col2 = st.columns(2)
-    with col1:
-        st.metric("Sentiment", mood_analysis["sentiment"])
-    with col2:
-        st.progress(
-            float(mood_analysis["score"] + 1) / 2,
-            text=f"Score: {mood_analysis['score']:.2f}",
-        )
+def alignment_scores_chart(alignments):
+    import pandas as pd
+    import plotly.express as px
 
-    with st.expander("Detailed Mood Analysis", expanded=True):
-        st.write(f"Analysis: {mood_analysis['analysis']}")
-        st.write(f"Career Impact: {mood_analysis['career_impact']}")
-
-    # Job Market Alignment
-    st.header("Job Market Alignment")
-    job_insights = results["job_insights"]
-
-    # Create a bar chart for job alignments
-    alignments = sorted(
-        job_insights["alignments"], key=lambda x: x["score"], reverse=True
+    job_market_data = pd.DataFrame(alignments)
+    return px.scatter(
+        job_market_data,
+        x="job_title",
+        y="score",
+        size="score",
+        hover_name="job_title",
+        title="Job Alignment Scores",
+        labels={"score": "Alignment Score", "job_title": "Job Title"},
     )
-    top_5_alignments = alignments[:5]
 
-    if not top_5_alignments:
-        st.write("No job alignments found.")
-    else:
-        fig = px.bar(
-            x=[a["job_title"] for a in top_5_alignments],
-            y=[a["score"] for a in top_5_alignments],
-            labels={"x": "Job Title", "y": "Alignment Score"},
-            title=f"Top {len(top_5_alignments)} Job Category Alignments",
-        )
-        st.plotly_chart(fig)
 
-    with st.expander("Alignment Details", expanded=True):
-        for alignment in top_5_alignments:
-            st.write(f"- {alignment['job_title']}: {alignment['score']:.2f}")
-            st.write(f"  Reason: {alignment['reason']}")
-
-    # Career Path Analysis
-    st.header("Career Path Analysis")
-    career_path_analysis = results["career_path_analysis"]
-
-    for key, value in career_path_analysis.items():
-        with st.expander(key.replace("_", " ").title(), expanded=True):
-            st.write(value)
-
-    # Skill Development Plan
-    st.header("Skill Development Plan")
-    skill_plan = results["skill_plan"]
-
-    col1, col2 = st.columns(2)
-    with col1:
-        with st.expander("Core Skills", expanded=True):
-            st.write(skill_plan["core_skills"])
-    with col2:
-        with st.expander("Skill Gaps", expanded=True):
-            st.write(skill_plan["skill_gaps"])
-
-    with st.expander("Learning Resources", expanded=True):
-        st.write(skill_plan["learning_resources"])
-
-    with st.expander("Timeline", expanded=True):
-        st.write(skill_plan["timeline"])
+def analysis_page(results):
+    # Built once per analysis; a rerun draws the same Figure objects instead of rebuilding
+    # the DataFrame and running plotly express again
+    top = top_alignments(results["job_insights"])
+    return {
+        "top_alignments": top,
+        "top_alignments_chart": top_alignments_chart(top) if top else None,
+        "alignment_scores_chart": alignment_scores_chart(
+            results["job_insights"]["alignments"]
+        ),
+    }
 
-    # Industry Forecast
-    st.header("Industry Forecast")
-    industry_forecast = results["industry_forecast"]
 
-    tabs = st.tabs(
-        [
-            "Relevant Industries",
-            "Technological Trends",
-            "Market Shifts",
-            "Potential Disruptions",
-            "Career Implications",
-        ]
+def display_analysis_results(results, analysis_id=None):
+    if analysis_id is None:
+        page = analysis_page(results)
+    else:
+        page = render_cache.get_or_build(analysis_id, lambda: analysis_page(results))
+
+    render_mood_analysis(results["mood_analysis"], expanded=True)
+    render_job_insights(
+        results["job_insights"],
+        expanded=True,
+        chart=page["top_alignments_chart"],
+        top=page["top_alignments"],
     )
-    for tab, (key, value) in zip(tabs, industry_forecast.items()):
-        with tab:
-            st.write(value)
+    render_tagged_section(
+        career_path_layout, results["career_path_analysis"], expanded=True
+    )
+    render_tagged_section(skill_plan_layout, results["skill_plan"], expanded=True)
+    render_tagged_section(industry_forecast_layout, results["industry_forecast"])
 
     # Job Market Data Visualization
     st.header("Job Market Overview")
-    job_market_data = pd.DataFrame(results["job_insights"]["alignments"])
-    fig = px.scatter(
-        job_market_data,
-        x="job_title",
-        y="score",
-        size="score",
-        hover_name="job_title",
-        title="Job Alignment Scores",
-        labels={"score": "Alignment Score", "job_title": "Job Title"},
-    )
-    st.plotly_chart(fig)
+    st.plotly_chart(page["alignment_scores_chart"])
 
 
 if __name__ == "__main__":
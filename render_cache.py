@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """In-memory LRU of what the results page draws for each finished analysis.
+
+    Entries are keyed by analysis id and hold the page's plotly Figure objects and
+    the top alignments its job insights section lists, built once by ``get_or_build``
+    and drawn again on every Streamlit rerun after that. Entries are shared between
+    sessions and only read once built.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, analysis_id):
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(analysis_id)
+            self.hits += 1
+            return entry
+
+    def set(self, analysis_id, entry):
+        with self._lock:
+            self._entries[analysis_id] = entry
+            self._entries.move_to_end(analysis_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, analysis_id, build):
+        entry = self.get(analysis_id)
+        if entry is None:
+            # Two reruns racing here both build; the result is the same either way
+            entry = build()
+            self.set(analysis_id, entry)
+        return entry
+
+    def discard(self, analysis_id):
+        with self._lock:
+            self._entries.pop(analysis_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
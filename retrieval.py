@@ -0,0 +1,67 @@
+import re
+
+# Words too common to say anything about which chunk a question is about
+STOPWORDS = set(
+    "a an and are as at be but by can could do does for from had has have how i if in into is it its "
+    "me my of on or our should so than that the their them then there these they this to was we were "
+    "what when where which who why will with would you your".split()
+)
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def split_words(text, max_words):
+    # Splits long text into pieces of at most max_words, on word boundaries
+    words = text.split()
+    return [" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words)] or [""]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks, held as a dense NumPy term-weight matrix.
+
+    Chunks are dicts with at least a ``text`` key. The index is built once; ``search``
+    only does a column lookup and a dot product, so it is cheap to run per question.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        # Imported on first use, like the other heavy modules, so it stays off the app's import path
+        import numpy as np
+
+        self.chunks = list(chunks)
+        documents = [tokenize(f"{chunk.get('title', '')} {chunk['text']}") for chunk in self.chunks]
+        self.vocabulary = {}
+        for document in documents:
+            for term in document:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+
+        frequencies = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for term in document:
+                frequencies[row, self.vocabulary[term]] += 1
+
+        lengths = frequencies.sum(axis=1)
+        average_length = lengths.mean() if len(documents) and lengths.mean() else 1.0
+        document_frequency = (frequencies > 0).sum(axis=0)
+        self.idf = np.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        # Saturated term frequencies, so a query only needs a dot product with the idf weights
+        norm = k1 * (1 - b + b * lengths / average_length)
+        self.weights = frequencies * (k1 + 1) / (frequencies + norm[:, None])
+
+    def scores(self, query):
+        import numpy as np
+
+        columns = [self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary]
+        if not columns:
+            return np.zeros(len(self.chunks), dtype=np.float32)
+        return self.weights[:, columns] @ self.idf[columns]
+
+    def search(self, query, k=5):
+        """The k best matching chunks as (score, chunk) pairs, best first; chunks with no matching terms are left out."""
+        import numpy as np
+
+        scores = self.scores(query)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(float(scores[i]), self.chunks[i]) for i in order if scores[i] > 0]
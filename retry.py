@@ -0,0 +1,182 @@
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits, server errors and Anthropic's 529 "overloaded"
+RETRYABLE_STATUSES = {408, 409, 429}
+# Exceptions raised for programming mistakes; retrying them only burns time
+FATAL_EXCEPTIONS = (TypeError, AttributeError, NameError, NotImplementedError)
+CONNECTION_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+class RetryError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def is_retryable(error):
+    # Works on both the openai and anthropic exception hierarchies, which share names and attributes
+    if isinstance(error, FATAL_EXCEPTIONS):
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    return True
+
+
+def is_provider_failure(error):
+    # Failures that say the provider itself is unhealthy, as opposed to a bad request or rate limit
+    status = status_code(error)
+    if status is not None:
+        return status >= 500
+    return type(error).__name__ in CONNECTION_ERROR_NAMES or isinstance(error, (ConnectionError, TimeoutError))
+
+
+def _parse_duration(value):
+    # Formats used by rate limit reset headers: "20ms", "1.5s", "6m0s", "1h2m3s"
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    delays = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if headers.get(name)
+    ]
+    delays = [delay for delay in delays if delay is not None]
+    return max(delays) if delays else None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that honours Retry-After and rate limit headers."""
+
+    def __init__(self, max_retries=10, base_delay=0.5, max_delay=30.0, jitter=True):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.stats = {"retries": 0, "fatal": 0, "exhausted": 0}
+        self._lock = threading.Lock()
+
+    def next_delay(self, error, attempt):
+        """Seconds to wait before retry number ``attempt`` (starting at 1), or None to give up."""
+        if not is_retryable(error):
+            self._count("fatal")
+            return None
+        if attempt > self.max_retries:
+            self._count("exhausted")
+            return None
+        self._count("retries")
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        hinted = retry_after(error)
+        if hinted is not None:
+            delay = max(delay, min(hinted, self.max_delay))
+        return delay
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+class CircuitBreaker:
+    """Fails fast after ``failure_threshold`` consecutive provider failures.
+
+    After ``reset_timeout`` seconds one trial call is let through; its outcome
+    closes the circuit again or keeps it open for another timeout. A trial that ends
+    without an outcome (e.g. it was cancelled) must be handed back with ``record_cancelled``.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {"opened": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, failing fast until it recovers")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+
+    def record_cancelled(self):
+        # The trial call gave no answer either way: open again, so another trial follows the next timeout
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_failure(self, error):
+        if not is_provider_failure(error):
+            # The provider answered (e.g. a 400 or 429), so it is up
+            self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opened"] += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, **kwargs):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+
+from retry import FATAL_EXCEPTIONS, RetryPolicy
+
+
+class ProviderHealth:
+    """Exponentially weighted latency, error rate and output throughput of one provider/model."""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.samples = 0
+        self.latency = None
+        self.ttft = None
+        self.error_rate = 0.0
+        self.throughput = None
+        self.last_update = 0.0
+
+    def _ewma(self, current, value):
+        return value if current is None else current + self.alpha * (value - current)
+
+    def observe(self, record):
+        self.samples += 1
+        self.last_update = time.monotonic()
+        failed = record["status"] == "error"
+        self.error_rate = self._ewma(self.error_rate, 1.0 if failed else 0.0)
+        if failed or record["duration"] is None:
+            return
+        self.latency = self._ewma(self.latency, record["duration"])
+        if record["ttft"] is not None:
+            self.ttft = self._ewma(self.ttft, record["ttft"])
+            generating = record["duration"] - record["ttft"]
+            if record["output_tokens"] and generating > 0:
+                self.throughput = self._ewma(self.throughput, record["output_tokens"] / generating)
+
+    def score(self):
+        # Expected latency, inflated by the chance of having to retry; None until measured
+        if self.latency is None:
+            return None
+        return self.latency * (1 + 2 * self.error_rate)
+
+    def as_dict(self):
+        return {
+            "samples": self.samples,
+            "latency": self.latency,
+            "ttft": self.ttft,
+            "error_rate": self.error_rate,
+            "throughput": self.throughput,
+        }
+
+
+class Router:
+    """Sends each stage to the best healthy client out of an ordered list of candidates.
+
+    Health comes from telemetry records: register ``router.observe`` as a Telemetry
+    listener. Error rates are kept per provider/model, latency per provider/model and
+    stage, since a short JSON stage says little about a long tagged one. The first
+    candidate is the preferred one and keeps the traffic unless it is unhealthy or
+    another candidate's score for the stage is better by more than ``switch_margin``. A
+    candidate is unhealthy while its circuit breaker is open or its error rate is above
+    ``max_error_rate``; after ``recovery_time`` seconds without news it gets tried again.
+    Failed calls fall over to the next candidate.
+    """
+
+    def __init__(self, max_error_rate=0.5, switch_margin=0.2, recovery_time=60.0, explore_rate=0.0, failover_retries=2):
+        self.max_error_rate = max_error_rate
+        self.switch_margin = switch_margin
+        self.recovery_time = recovery_time
+        self.explore_rate = explore_rate
+        # With somewhere else to go, a failing provider gets fewer retries before the next candidate is tried
+        self.failover_policy = RetryPolicy(max_retries=failover_retries)
+        self.health = {}
+        self.stage_health = {}
+        self.stats = {"routed": 0, "rerouted": 0, "failovers": 0}
+
+    def health_of(self, client):
+        key = (client.provider, client.model)
+        if key not in self.health:
+            self.health[key] = ProviderHealth()
+        return self.health[key]
+
+    def observe(self, record):
+        if record["cache_hit"] or record["coalesced"] or record["status"] == "cancelled":
+            # Nothing was asked of the provider, or the answer never came
+            return
+        if record.get("hedge_winner") == "backup":
+            # The timings are the backup provider's, only the outcome counts for this one
+            record = {**record, "duration": None}
+        key = (record["provider"], record["model"])
+        if key not in self.health:
+            self.health[key] = ProviderHealth()
+        self.health[key].observe(record)
+        stage_key = (*key, record["stage"])
+        if stage_key not in self.stage_health:
+            self.stage_health[stage_key] = ProviderHealth()
+        self.stage_health[stage_key].observe(record)
+
+    def score(self, client, stage=None):
+        health = self.stage_health.get((client.provider, client.model, stage))
+        return health.score() if health is not None else None
+
+    def is_healthy(self, client):
+        if client.circuit_breaker.state == "open":
+            return False
+        health = self.health_of(client)
+        if time.monotonic() - health.last_update > self.recovery_time:
+            return True
+        return health.error_rate <= self.max_error_rate
+
+    def rank(self, candidates, stage=None):
+        healthy = [client for client in candidates if self.is_healthy(client)]
+        unhealthy = [client for client in candidates if client not in healthy]
+        if not healthy:
+            return list(candidates)
+        first = healthy[0]
+        if self.explore_rate and random.random() < self.explore_rate:
+            first = random.choice(healthy)
+        else:
+            scored = [(self.score(client, stage), client) for client in healthy]
+            scored = [(score, client) for score, client in scored if score is not None]
+            preferred = self.score(first, stage)
+            if scored:
+                best_score, best = min(scored, key=lambda item: item[0])
+                if preferred is not None and best_score < preferred * (1 - self.switch_margin):
+                    first = best
+        return [first] + [client for client in healthy if client is not first] + unhealthy
+
+    async def run(self, candidates, ask, session_id=None, stage=None):
+        """Calls ``await ask(client)`` with a fork of the best candidate, falling over to the next ones on failure."""
+        ranked = self.rank(candidates, stage)
+        self.stats["routed"] += 1
+        if ranked[0] is not candidates[0]:
+            self.stats["rerouted"] += 1
+        error = None
+        for position, candidate in enumerate(ranked):
+            client = candidate.fork(session_id=session_id, stage=stage)
+            if position < len(ranked) - 1:
+                client.retry_policy = self.failover_policy
+            try:
+                return await ask(client)
+            except asyncio.CancelledError:
+                raise
+            except FATAL_EXCEPTIONS:
+                raise
+            except Exception as e:
+                error = e
+                if position < len(ranked) - 1:
+                    print(f"{candidate.provider}/{candidate.model} failed for {stage}, trying the next provider: {e}")
+                    self.stats["failovers"] += 1
+        raise error
+
+    def summary(self):
+        return [
+            {"provider": provider, "model": model, **health.as_dict()}
+            for (provider, model), health in sorted(self.health.items())
+        ]
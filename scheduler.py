@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Requests larger than the whole bucket would wait forever, so they only need a full bucket
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    def __init__(self, future, session_id, tokens):
+        self.future = future
+        self.session_id = session_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+
+
+class ProviderScheduler:
+    """Admits requests to one provider/model under request, token and concurrency limits.
+
+    Waiting requests are served by priority, and round-robin across sessions within
+    a priority, so one session with many queued calls cannot starve the others.
+    All limits are optional; ``None`` means unlimited.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None, name="scheduler"):
+        self.name = name
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.granted = 0
+        self.waits = deque(maxlen=1000)
+        # priority -> session id -> queued waiters, plus the round-robin order of sessions
+        self._queues = {}
+        self._sessions = {}
+        self._wakeup = None
+
+    @property
+    def queue_depth(self):
+        return sum(len(waiters) for sessions in self._queues.values() for waiters in sessions.values())
+
+    def _next_waiter(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            order = self._sessions[priority]
+            while order:
+                session_id = order[0]
+                waiters = sessions.get(session_id)
+                if waiters:
+                    return priority, session_id, waiters[0]
+                order.popleft()
+                sessions.pop(session_id, None)
+        return None
+
+    def _dequeue(self, priority, session_id):
+        waiters = self._queues[priority][session_id]
+        waiters.popleft()
+        order = self._sessions[priority]
+        order.popleft()
+        if waiters:
+            # Back of the line for this session's next request
+            order.append(session_id)
+        else:
+            del self._queues[priority][session_id]
+
+    def _dispatch(self):
+        self._wakeup = None
+        while True:
+            if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+                return
+            found = self._next_waiter()
+            if found is None:
+                return
+            priority, session_id, waiter = found
+            if waiter.future.done():
+                # Cancelled while queued
+                self._dequeue(priority, session_id)
+                continue
+
+            wait = 0.0
+            if self.request_bucket:
+                wait = max(wait, self.request_bucket.wait_time(1))
+            if self.token_bucket:
+                wait = max(wait, self.token_bucket.wait_time(waiter.tokens))
+            if wait > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            self._dequeue(priority, session_id)
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            self.waits.append(time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority=PRIORITY_DEFAULT, session_id=None, tokens=0):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), session_id, tokens)
+        sessions = self._queues.setdefault(priority, {})
+        if session_id not in sessions:
+            sessions[session_id] = deque()
+            self._sessions.setdefault(priority, deque()).append(session_id)
+        sessions[session_id].append(waiter)
+        if self._wakeup is None:
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just before the cancellation arrived
+                self.release()
+            elif waiter in sessions.get(session_id, ()):
+                sessions[session_id].remove(waiter)
+            raise
+        return time.monotonic() - waiter.enqueued
+
+    def release(self):
+        self.in_flight -= 1
+        if self._wakeup is None:
+            self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=PRIORITY_DEFAULT, session_id=None, tokens=0):
+        wait = await self.acquire(priority, session_id, tokens)
+        try:
+            yield wait
+        finally:
+            self.release()
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider, model=None, **limits):
+    # One scheduler per provider and model: providers set rate limits per model, and a cheap
+    # model's calls shouldn't queue behind the main model's traffic
+    key = (provider, model)
+    with _schedulers_lock:
+        if key not in _schedulers:
+            name = f"{provider}/{model}" if model else provider
+            _schedulers[key] = ProviderScheduler(name=name, **limits)
+        return _schedulers[key]
+
+
+def scheduler_stats():
+    """Queue depth, in-flight requests and waits of every scheduler, one row each."""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return [{"scheduler": scheduler.name, **scheduler.stats()} for scheduler in schedulers]
@@ -0,0 +1,67 @@
+import asyncio
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.subscribers = []
+        self.waiters = 0
+        self.task = None
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        for subscriber in list(self.subscribers):
+            subscriber(chunk)
+
+
+class SingleFlight:
+    """Lets concurrent identical requests share one upstream call.
+
+    The first caller for a key starts the call; callers arriving while it runs wait for
+    the same result. Every caller's ``on_chunk`` sees the full chunk sequence: late joiners
+    get the chunks so far replayed, then the rest as they arrive. The call keeps running
+    as long as at least one caller still waits for it.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def in_flight(self):
+        return len(self._flights)
+
+    async def run(self, key, func, on_chunk=None):
+        """Returns ``(result, coalesced)``; ``func(publish)`` makes the call and passes every chunk to ``publish``."""
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.stats["coalesced"] += 1
+            if on_chunk:
+                for chunk in flight.chunks:
+                    on_chunk(chunk)
+        else:
+            self.stats["leaders"] += 1
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(func(flight.publish))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+
+        if on_chunk:
+            flight.subscribers.append(on_chunk)
+        flight.waiters += 1
+        try:
+            # Shielded, so one caller being cancelled doesn't cancel the call for the others
+            return await asyncio.shield(flight.task), coalesced
+        finally:
+            flight.waiters -= 1
+            if on_chunk:
+                flight.subscribers.remove(on_chunk)
+            if flight.waiters == 0 and not flight.task.done():
+                # Everyone waiting on it gave up
+                flight.task.cancel()
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Marks the exception as retrieved when every waiter was cancelled before it arrived
+            flight.task.exception()
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), on_done=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.on_done = on_done
+
+
+class StageGraph:
+    """Runs async stages as soon as the stages they depend on have finished.
+
+    Each stage function is called with the results of its inputs as keyword
+    arguments. At most ``max_concurrency`` stage functions run at once.
+    """
+
+    def __init__(self, max_concurrency=4):
+        self.stages = {}
+        self.max_concurrency = max_concurrency
+        self.timings = {}
+
+    def add_stage(self, name, func, inputs=(), on_done=None):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = Stage(name, func, inputs, on_done)
+        return self
+
+    def _check_graph(self):
+        for stage in self.stages.values():
+            for dependency in stage.inputs:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle detected at stage {name}")
+            visiting.add(name)
+            for dependency in self.stages[name].inputs:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self):
+        self._check_graph()
+        loop = asyncio.get_running_loop()
+        futures = {name: loop.create_future() for name in self.stages}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.timings = {}
+
+        async def run_stage(stage):
+            try:
+                inputs = await asyncio.gather(*(futures[dependency] for dependency in stage.inputs))
+                async with semaphore:
+                    start = time.perf_counter()
+                    result = await stage.func(**dict(zip(stage.inputs, inputs)))
+                    self.timings[stage.name] = time.perf_counter() - start
+                if stage.on_done:
+                    stage.on_done(result)
+                futures[stage.name].set_result(result)
+            except asyncio.CancelledError:
+                futures[stage.name].cancel()
+                raise
+            except Exception as e:
+                if not futures[stage.name].done():
+                    futures[stage.name].set_exception(e)
+                raise
+
+        tasks = [asyncio.ensure_future(run_stage(stage)) for stage in self.stages.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Mark exceptions left on futures nobody awaited as retrieved
+            for future in futures.values():
+                if future.done() and not future.cancelled():
+                    future.exception()
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,93 @@
+import asyncio
+
+from unified import count_tokens, message_text
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant. You are given the current summary and the messages that follow it. Return an updated summary that keeps the facts, decisions, open questions and user preferences from both, in plain prose of at most {words} words. Return only the summary."""
+
+
+class RollingSummary:
+    """Summary of the oldest messages of a conversation, shared by the copies of that conversation.
+
+    ``covers`` is the position (counting every message ever added) up to which messages are in
+    the summary; ``Conversation.fold`` drops them from the history before the next request.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.covers = 0
+        self.tokens = 0
+        self.pending = False
+
+    def update(self, text, covers):
+        self.text = text
+        self.tokens = count_tokens(text)
+        self.covers = covers
+
+
+class ConversationSummarizer:
+    """Keeps a conversation within ``max_tokens`` by folding its oldest turns into a running summary.
+
+    After a reply, if the history plus the summary is over ``max_tokens``, every turn but the
+    newest ``keep_turns`` is summarized by ``client`` (a UnifiedApis instance for a cheaper
+    model, without JSON mode) together with the previous summary. On an event loop this runs
+    as a background task and the folded turns are dropped on the first request after it
+    finishes; meanwhile requests send the full history. Without a running loop it runs inline.
+    """
+
+    def __init__(self, client, max_tokens=1500, keep_turns=3, summary_words=200, stage="conversation_summary"):
+        self.client = client
+        self.max_tokens = max_tokens
+        self.keep_turns = max(1, keep_turns)
+        self.summary_words = summary_words
+        self.stage = stage
+        self.stats = {"compactions": 0, "failures": 0, "folded_messages": 0}
+        # Running tasks, referenced so they aren't garbage collected before they finish
+        self._tasks = set()
+
+    def schedule(self, conversation, session_id=None):
+        if conversation.summary is None:
+            conversation.summary = RollingSummary()
+        summary = conversation.summary
+        if summary.pending or conversation.token_count() + summary.tokens <= self.max_tokens:
+            return None
+        history = list(conversation.history)
+        # The fold ends where the oldest kept turn starts, so the history still opens with a user message
+        starts = [index for index, message in enumerate(history) if message["role"] == "user"]
+        if len(starts) <= self.keep_turns or starts[-self.keep_turns] == 0:
+            return None
+        end = starts[-self.keep_turns]
+        summary.pending = True
+        compaction = self._compact(summary, history[:end], conversation.dropped + end, session_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(compaction)
+        task = loop.create_task(compaction)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _compact(self, summary, messages, covers, session_id):
+        try:
+            text = await self._summarize(summary.text, messages, session_id)
+        except Exception as e:
+            # The history keeps the turns and is folded on a later reply
+            print("Error:", e)
+            self.stats["failures"] += 1
+            return
+        finally:
+            summary.pending = False
+        summary.update(str(text).strip(), covers)
+        self.stats["compactions"] += 1
+        self.stats["folded_messages"] += len(messages)
+
+    async def _summarize(self, previous, messages, session_id):
+        client = self.client.fork(session_id=session_id, stage=self.stage)
+        client.set_system_message(SUMMARY_PROMPT.format(words=self.summary_words))
+        transcript = "\n\n".join(f"{message['role'].capitalize()}: {message_text(message)}" for message in messages)
+        prompt = f"Current summary:\n{previous or '(none yet)'}\n\nMessages:\n{transcript}"
+        # Room for the summary with some slack, as words run longer than tokens
+        max_tokens = self.summary_words * 2
+        if client.use_async:
+            return await client.chat_async(prompt, max_tokens=max_tokens)
+        return client.chat(prompt, max_tokens=max_tokens)
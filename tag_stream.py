@@ -0,0 +1,74 @@
+import re
+
+
+class TagStreamParser:
+    """Incrementally splits a streamed reply into ``<tag>...</tag>`` sections.
+
+    ``on_update(tag, delta, done)`` is called with the new text every time a section
+    grows, and once more with ``done=True`` when its closing tag arrives. The full text
+    is joined only on demand via ``text(tag)``. Text outside the requested tags is ignored.
+    """
+
+    def __init__(self, tags, on_update=None):
+        self.tags = list(tags)
+        self.on_update = on_update
+        self.sections = {}
+        self.current = None
+        self._buffer = ""
+        self._open_pattern = re.compile("<(" + "|".join(re.escape(tag) for tag in self.tags) + ")>")
+        self._longest_tag = max((len(tag) for tag in self.tags), default=0) + 3
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        while self._buffer:
+            if self.current is None:
+                match = self._open_pattern.search(self._buffer)
+                if not match:
+                    # Keep only a tail that may still turn into an opening tag
+                    start = self._buffer.rfind("<")
+                    if start == -1 or len(self._buffer) - start > self._longest_tag:
+                        self._buffer = ""
+                    else:
+                        self._buffer = self._buffer[start:]
+                    return
+                self.current = match.group(1)
+                # A tag that opens again (e.g. the reply was retried) starts over
+                self.sections[self.current] = []
+                self._buffer = self._buffer[match.end():]
+                continue
+
+            closing = f"</{self.current}>"
+            end = self._buffer.find(closing)
+            if end != -1:
+                delta = self._buffer[:end]
+                self._append(delta)
+                self._buffer = self._buffer[end + len(closing):]
+                tag, self.current = self.current, None
+                self._emit(tag, delta, done=True)
+                continue
+
+            # Hold back a possible partial closing tag at the end of the buffer
+            safe = len(self._buffer)
+            start = self._buffer.rfind("<", max(0, safe - len(closing) + 1))
+            if start != -1 and closing.startswith(self._buffer[start:]):
+                safe = start
+            if safe:
+                delta = self._buffer[:safe]
+                self._append(delta)
+                self._buffer = self._buffer[safe:]
+                self._emit(self.current, delta, done=False)
+            return
+
+    def _append(self, text):
+        if text:
+            self.sections[self.current].append(text)
+
+    def _emit(self, tag, delta, done):
+        if self.on_update:
+            self.on_update(tag, delta, done)
+
+    def text(self, tag):
+        return "".join(self.sections.get(tag, [])).strip()
+
+    def result(self):
+        return {tag: self.text(tag) for tag in self.tags if tag in self.sections}
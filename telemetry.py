@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from collections import deque
+
+# Fields of a call record that hold token counts
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+# Fields that hold durations in seconds and get percentiles
+TIMING_FIELDS = ("duration", "ttft", "queue_wait")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))]
+
+
+def prompt_tokens(record):
+    # Anthropic counts cached prompt tokens apart from input_tokens, OpenAI-style APIs include them
+    if record["provider"] == "anthropic":
+        return record["input_tokens"] + record["cache_read_tokens"] + record["cache_write_tokens"]
+    return record["input_tokens"]
+
+
+def new_call(provider, model, stage=None, session_id=None):
+    """One record per UnifiedApis request, filled in as the request progresses."""
+    return {
+        "timestamp": time.time(),
+        "provider": provider,
+        "model": model,
+        "stage": stage,
+        "session_id": session_id,
+        "status": "ok",
+        "error": None,
+        "cache_hit": False,
+        # Shared an identical in-flight request instead of making its own
+        "coalesced": False,
+        # A backup request was raced against this one, and which of the two was used
+        "hedged": False,
+        "hedge_winner": None,
+        "retries": 0,
+        "validation_retries": 0,
+        "queue_wait": 0.0,
+        "ttft": None,
+        "duration": None,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_tokens": 0,
+        "cache_write_tokens": 0,
+    }
+
+
+class Telemetry:
+    """Keeps the most recent call records and hands each new one to the registered listeners.
+
+    A listener is any callable taking the record dict, e.g. a ``JsonlExporter``.
+    """
+
+    def __init__(self, max_records=10000):
+        self.records = deque(maxlen=max_records)
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        return listener
+
+    def record(self, call):
+        with self._lock:
+            self.records.append(call)
+        for listener in self.listeners:
+            try:
+                listener(call)
+            except Exception as e:
+                # Telemetry must never break the request it describes
+                print(f"Telemetry listener failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+    def models_by_stage(self, session_id, since=0.0):
+        """``provider/model`` that last answered each stage of a session since ``since`` (a time.time())."""
+        with self._lock:
+            records = list(self.records)
+        return {
+            record["stage"]: f"{record['provider']}/{record['model']}"
+            for record in records
+            if record["session_id"] == session_id and record["timestamp"] >= since and record["status"] == "ok"
+        }
+
+    def _groups(self, keys):
+        with self._lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            groups.setdefault(tuple(record[key] for key in keys), []).append(record)
+        return groups
+
+    def summary(self, keys=("stage",)):
+        """Per-group call counts, token totals and p50/p95 of the timings, as a list of rows."""
+        rows = []
+        for group, records in sorted(self._groups(keys).items(), key=lambda item: str(item[0])):
+            row = dict(zip(keys, group))
+            row["calls"] = len(records)
+            row["errors"] = sum(record["status"] != "ok" for record in records)
+            row["cache_hits"] = sum(record["cache_hit"] for record in records)
+            row["coalesced"] = sum(record["coalesced"] for record in records)
+            row["hedged"] = sum(record["hedged"] for record in records)
+            row["hedge_backup_wins"] = sum(record["hedge_winner"] == "backup" for record in records)
+            row["retries"] = sum(record["retries"] + record["validation_retries"] for record in records)
+            for field in TIMING_FIELDS:
+                values = [record[field] for record in records if record[field] is not None]
+                row[f"{field}_p50"] = percentile(values, 0.50)
+                row[f"{field}_p95"] = percentile(values, 0.95)
+            for field in TOKEN_FIELDS:
+                row[field] = sum(record[field] for record in records)
+            # Shares of the prompt tokens served from, and written to, the provider's prompt cache
+            prompt = sum(prompt_tokens(record) for record in records)
+            row["cache_read_ratio"] = row["cache_read_tokens"] / prompt if prompt else 0.0
+            row["cache_write_ratio"] = row["cache_write_tokens"] / prompt if prompt else 0.0
+            rows.append(row)
+        return rows
+
+    def prometheus(self, prefix="unified"):
+        """The recorded calls in the Prometheus text exposition format."""
+        groups = self._groups(("provider", "model", "stage"))
+        lines = []
+
+        def labels(group, **extra):
+            names = dict(zip(("provider", "model", "stage"), group), **extra)
+            return ",".join(f'{name}="{str(value or "").replace(chr(34), "")}"' for name, value in names.items())
+
+        for field in TIMING_FIELDS:
+            metric = f"{prefix}_{field}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for group, records in groups.items():
+                values = [record[field] for record in records if record[field] is not None]
+                for quantile in (0.5, 0.95):
+                    value = percentile(values, quantile)
+                    if value is not None:
+                        lines.append(f"{metric}{{{labels(group, quantile=quantile)}}} {value}")
+                lines.append(f"{metric}_sum{{{labels(group)}}} {sum(values)}")
+                lines.append(f"{metric}_count{{{labels(group)}}} {len(values)}")
+
+        lines.append(f"# TYPE {prefix}_calls_total counter")
+        for group, records in groups.items():
+            statuses = {}
+            for record in records:
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            for status, count in statuses.items():
+                lines.append(f"{prefix}_calls_total{{{labels(group, status=status)}}} {count}")
+
+        lines.append(f"# TYPE {prefix}_tokens_total counter")
+        for group, records in groups.items():
+            for field in TOKEN_FIELDS:
+                kind = field[: -len("_tokens")]
+                lines.append(f"{prefix}_tokens_total{{{labels(group, kind=kind)}}} {sum(record[field] for record in records)}")
+
+        counters = (
+            ("cache_hits", lambda r: r["cache_hit"]),
+            ("coalesced", lambda r: r["coalesced"]),
+            ("hedged", lambda r: r["hedged"]),
+            ("hedge_backup_wins", lambda r: r["hedge_winner"] == "backup"),
+            ("retries", lambda r: r["retries"] + r["validation_retries"]),
+        )
+        for name, count in counters:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for group, records in groups.items():
+                lines.append(f"{prefix}_{name}_total{{{labels(group)}}} {sum(count(record) for record in records)}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonlExporter:
+    """Telemetry listener that appends every call record to a JSONL file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, call):
+        line = json.dumps(call, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from analysis_store import AnalysisStore
+from telemetry import Telemetry, new_call
+
+
+def test_fused_stage_models_are_stored_per_stage(monkeypatch):
+    monkeypatch.setenv("OFFLINE", "1")
+    import career_assistant
+
+    telemetry = Telemetry()
+    monkeypatch.setattr(career_assistant, "telemetry", telemetry)
+    telemetry.record(new_call("openai", "gpt-4o", "profile_analysis", "session"))
+    # The mood part failed validation and was asked for again on its own
+    telemetry.record(new_call("anthropic", "claude", "mood_analysis", "session"))
+    telemetry.record(new_call("anthropic", "claude", "skill_plan", "session"))
+
+    store = AnalysisStore(path=":memory:")
+    results = {name: {"stage": name} for name in career_assistant.ANALYSIS_SECTIONS}
+    analysis_id = career_assistant.save_analysis(
+        SimpleNamespace(session_id="session"), "input", "skills", results, store=store
+    )
+    models = store.load(analysis_id)["models"]
+    assert models["job_insights"] == "openai/gpt-4o"
+    assert models["mood_analysis"] == "anthropic/claude"
+    assert models["skill_plan"] == "anthropic/claude"
+    assert "profile_analysis" not in models
+
+
+def test_store_opens_its_file_on_first_use(tmp_path):
+    path = tmp_path / "analyses.sqlite"
+    store = AnalysisStore(path=str(path))
+    assert not path.exists()
+    analysis_id = store.save({"mood_analysis": {"score": 1}}, "input", "skills")
+    reopened = AnalysisStore(path=str(path))
+    assert reopened.load(analysis_id)["results"] == {"mood_analysis": {"score": 1}}
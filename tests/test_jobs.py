@@ -0,0 +1,16 @@
+from jobs import Job
+
+
+def test_snapshot_hands_out_only_new_text():
+    job = Job(run=None)
+    seen = {}
+    job.add_text("skill_plan", "<core_skills>Py")
+    assert job.snapshot(seen=seen)["text"] == {"skill_plan": "<core_skills>Py"}
+    job.add_text("skill_plan", "thon</core_skills>")
+    job.add_text("industry_forecast", "<market_shifts>")
+    assert job.snapshot(seen=seen)["text"] == {
+        "skill_plan": "thon</core_skills>",
+        "industry_forecast": "<market_shifts>",
+    }
+    assert job.snapshot(seen=seen)["text"] == {"skill_plan": "", "industry_forecast": ""}
+    assert job.snapshot()["text"]["skill_plan"] == "<core_skills>Python</core_skills>"
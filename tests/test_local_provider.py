@@ -0,0 +1,30 @@
+import pytest
+
+from local_provider import LocalClient, LocalProviderError
+
+
+def ask(client, text):
+    messages = [{"role": "user", "content": text}]
+    for _ in range(50):
+        try:
+            return client.chat.completions.create(model="local", messages=messages)
+        except LocalProviderError:
+            continue
+    pytest.fail("the request never succeeded")
+
+
+def test_retried_request_succeeds_and_is_forgotten():
+    client = LocalClient(error_rate=0.5, seed=1)
+    for i in range(200):
+        ask(client, f"question {i}")
+    assert client.errors > 0
+    assert len(client._attempts) == 0
+
+
+def test_failed_requests_tracked_are_bounded():
+    client = LocalClient(error_rate=1.0)
+    client.max_tracked = 10
+    for i in range(50):
+        with pytest.raises(LocalProviderError):
+            client.chat.completions.create(model="local", messages=[{"role": "user", "content": str(i)}])
+    assert len(client._attempts) == 10
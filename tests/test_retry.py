@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import pytest
+
+import retry
+from retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, "monotonic", clock)
+    return clock
+
+
+def failing_breaker(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure(ConnectionError("down"))
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = failing_breaker(clock)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats == {"opened": 1, "rejected": 1}
+
+
+def test_breaker_ignores_errors_that_are_not_provider_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    breaker.record_failure(SimpleNamespace(status_code=400))
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = failing_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_trial_opens_again(clock):
+    breaker = failing_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure(ConnectionError("still down"))
+    assert breaker.state == "open"
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_trial_is_handed_back(clock):
+    breaker = failing_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_cancelled()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_cancelled_call_leaves_a_closed_breaker_alone(clock):
+    breaker = CircuitBreaker("test")
+    breaker.before_call()
+    breaker.record_cancelled()
+    assert breaker.state == "closed"
+
+
+def test_backoff_doubles_up_to_the_cap():
+    policy = RetryPolicy(max_retries=5, base_delay=1, max_delay=5, jitter=False)
+    error = ConnectionError("down")
+    assert [policy.next_delay(error, attempt) for attempt in range(1, 7)] == [1, 2, 4, 5, 5, None]
+    assert policy.stats == {"retries": 5, "fatal": 0, "exhausted": 1}
+
+
+def test_retry_after_header_is_honoured():
+    policy = RetryPolicy(base_delay=0.5, jitter=False)
+    error = SimpleNamespace(status_code=429, response=SimpleNamespace(headers={"retry-after": "3"}))
+    assert policy.next_delay(error, 1) == 3
+    error.response.headers = {"x-ratelimit-reset-requests": "1.5s", "x-ratelimit-reset-tokens": "6m0s"}
+    assert policy.next_delay(error, 1) == policy.max_delay
+
+
+def test_fatal_and_client_errors_are_not_retried():
+    policy = RetryPolicy(jitter=False)
+    assert policy.next_delay(AttributeError("no such method"), 1) is None
+    assert policy.next_delay(SimpleNamespace(status_code=400), 1) is None
+    assert policy.next_delay(SimpleNamespace(status_code=503), 1) == policy.base_delay
+    assert policy.stats["fatal"] == 2
@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from retry import CircuitBreaker
+from router import Router
+
+
+class Candidate:
+    """Stands in for a UnifiedApis instance: what the router reads and the fork it calls."""
+
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+        self.circuit_breaker = CircuitBreaker(f"{provider}/{model}")
+        self.retry_policy = None
+
+    def fork(self, session_id=None, stage=None):
+        return SimpleNamespace(candidate=self, stage=stage, retry_policy=self.retry_policy)
+
+
+def record(client, duration=1.0, status="ok", stage="stage"):
+    return {
+        "provider": client.provider,
+        "model": client.model,
+        "stage": stage,
+        "status": status,
+        "duration": duration,
+        "ttft": None,
+        "output_tokens": 0,
+        "cache_hit": False,
+        "coalesced": False,
+    }
+
+
+def test_preferred_candidate_keeps_the_traffic_until_another_is_clearly_faster():
+    router = Router(switch_margin=0.2)
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    router.observe(record(first, duration=1.0))
+    router.observe(record(second, duration=0.9))
+    assert router.rank([first, second], "stage") == [first, second]
+    for _ in range(10):
+        router.observe(record(second, duration=0.2))
+    assert router.rank([first, second], "stage") == [second, first]
+    # Latency is kept per stage
+    assert router.rank([first, second], "other stage") == [first, second]
+
+
+def test_unhealthy_candidates_go_last():
+    router = Router(max_error_rate=0.5)
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    for _ in range(5):
+        router.observe(record(first, status="error"))
+    assert router.rank([first, second]) == [second, first]
+
+
+def test_open_circuit_goes_last():
+    router = Router()
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    first.circuit_breaker.state = "open"
+    assert router.rank([first, second]) == [second, first]
+
+
+def test_failover_to_the_next_candidate():
+    router = Router()
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    asked = []
+
+    async def ask(client):
+        asked.append(client.candidate)
+        if client.candidate is first:
+            raise ConnectionError("down")
+        return "answer"
+
+    assert asyncio.run(router.run([first, second], ask, stage="stage")) == "answer"
+    assert asked == [first, second]
+    assert router.stats["failovers"] == 1
+
+
+def test_fewer_retries_when_there_is_somewhere_to_fail_over_to():
+    router = Router(failover_retries=1)
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    policies = {}
+
+    async def ask(client):
+        policies[client.candidate] = client.retry_policy
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(router.run([first, second], ask))
+    assert policies[first] is router.failover_policy
+    assert policies[second] is None
+
+
+@pytest.mark.parametrize("error", [AttributeError("no such method"), TypeError("bad call")])
+def test_fatal_errors_are_not_failed_over(error):
+    router = Router()
+    first, second = Candidate("a", "1"), Candidate("b", "2")
+    asked = []
+
+    async def ask(client):
+        asked.append(client.candidate)
+        raise error
+
+    with pytest.raises(type(error)):
+        asyncio.run(router.run([first, second], ask))
+    assert asked == [first]
+    assert router.stats["failovers"] == 0
+
+
+def test_cached_coalesced_and_cancelled_calls_are_not_health():
+    router = Router()
+    client = Candidate("a", "1")
+    router.observe({**record(client), "cache_hit": True})
+    router.observe({**record(client), "coalesced": True})
+    router.observe(record(client, status="cancelled"))
+    assert router.health_of(client).samples == 0
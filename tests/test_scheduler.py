@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import PRIORITY_INTERACTIVE, ProviderScheduler, get_scheduler, scheduler_stats
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    return clock
+
+
+def test_schedulers_are_per_model():
+    main = get_scheduler("test-provider", "big", max_concurrency=2)
+    cheap = get_scheduler("test-provider", "small", max_concurrency=8)
+    assert main is get_scheduler("test-provider", "big")
+    assert main is not cheap
+    assert (main.max_concurrency, cheap.max_concurrency) == (2, 8)
+    names = {row["scheduler"] for row in scheduler_stats()}
+    assert {"test-provider/big", "test-provider/small"} <= names
+    assert all("queue_depth" in row for row in scheduler_stats())
+
+
+async def advance(clock, limiter, seconds):
+    # Moves the clock on and runs the wakeup the scheduler set for itself, instead of sleeping
+    clock.now += seconds
+    limiter._wakeup.cancel()
+    limiter._dispatch()
+    await asyncio.sleep(0)
+
+
+def test_requests_per_minute(clock):
+    async def scenario():
+        limiter = ProviderScheduler(requests_per_minute=2)
+        await limiter.acquire()
+        await limiter.acquire()
+        third = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not third.done()
+        delay = limiter._wakeup.when() - asyncio.get_running_loop().time()
+        assert delay == pytest.approx(30, abs=0.5)
+        await advance(clock, limiter, 29)
+        assert not third.done()
+        await advance(clock, limiter, 1)
+        assert third.done()
+        assert limiter.granted == 3
+
+    asyncio.run(scenario())
+
+
+def test_tokens_per_minute(clock):
+    async def scenario():
+        limiter = ProviderScheduler(tokens_per_minute=600)
+        await limiter.acquire(tokens=600)
+        small = asyncio.ensure_future(limiter.acquire(tokens=300))
+        await asyncio.sleep(0)
+        assert not small.done()
+        await advance(clock, limiter, 30)
+        assert small.done()
+        # Larger than the whole budget: it only waits for a full bucket
+        large = asyncio.ensure_future(limiter.acquire(tokens=5000))
+        await asyncio.sleep(0)
+        await advance(clock, limiter, 59)
+        assert not large.done()
+        await advance(clock, limiter, 1)
+        assert large.done()
+
+    asyncio.run(scenario())
+
+
+def test_priority_then_round_robin_across_sessions():
+    async def scenario():
+        limiter = ProviderScheduler(max_concurrency=1)
+        served = []
+
+        async def request(name, session_id, priority=scheduler.PRIORITY_DEFAULT):
+            async with limiter.slot(priority, session_id):
+                served.append(name)
+                await asyncio.sleep(0)
+
+        async with limiter.slot():
+            tasks = [
+                asyncio.ensure_future(request("a1", "a")),
+                asyncio.ensure_future(request("a2", "a")),
+                asyncio.ensure_future(request("b1", "b")),
+                asyncio.ensure_future(request("chat", "c", PRIORITY_INTERACTIVE)),
+            ]
+            await asyncio.sleep(0)
+            assert limiter.queue_depth == 4
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(scenario()) == ["chat", "a1", "b1", "a2"]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        limiter = ProviderScheduler(max_concurrency=1)
+        await limiter.acquire()
+        cancelled = asyncio.ensure_future(limiter.acquire(session_id="a"))
+        waiting = asyncio.ensure_future(limiter.acquire(session_id="b"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        limiter.release()
+        await waiting
+        assert limiter.in_flight == 1
+        assert limiter.queue_depth == 0
+
+    asyncio.run(scenario())
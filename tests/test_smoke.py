@@ -0,0 +1,47 @@
+"""Smoke tests: the entry points import and the first page renders, offline (OFFLINE=1)."""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_offline(code, cwd):
+    # A fresh interpreter, so module-level mistakes fail here the way they would at startup
+    env = dict(os.environ, OFFLINE="1", UNIFIED_SERVER_MODE="1", PYTHONPATH=str(ROOT))
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, timeout=120
+    )
+
+
+@pytest.mark.parametrize("module", ["career_assistant", "batch", "bench", "main"])
+def test_import(module, tmp_path):
+    result = run_offline(f"import {module}", tmp_path)
+    assert result.returncode == 0, result.stderr
+    # Stores open their files on first use, so importing leaves nothing behind
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_first_render(tmp_path):
+    pytest.importorskip("streamlit")
+    result = run_offline(
+        "from streamlit.testing.v1 import AppTest\n"
+        f"app = AppTest.from_file({str(ROOT / 'main.py')!r}, default_timeout=120).run()\n"
+        "assert not app.exception, app.exception",
+        tmp_path,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_rate_limits_per_model(monkeypatch):
+    monkeypatch.setenv("OFFLINE", "1")
+    import career_assistant
+
+    monkeypatch.setenv("OPENAI_RPM", "500")
+    monkeypatch.setenv("OPENAI_GPT_4O_MINI_RPM", "5000")
+    assert career_assistant.rate_limits("openai", "gpt-4o-mini")["requests_per_minute"] == 5000
+    assert career_assistant.rate_limits("openai", "gpt-4o")["requests_per_minute"] == 500
@@ -0,0 +1,248 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from local_provider import _completion, _usage
+from response_cache import ResponseCache
+from retry import RetryPolicy
+from unified import UnifiedApis
+
+
+class ScriptedClient:
+    """Stands in for an OpenAI-style SDK client and answers with ``replies`` in order."""
+
+    def __init__(self, replies, use_async=False):
+        self.replies = list(replies)
+        self.calls = 0
+        create = self._create_async if use_async else self._create
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+    def _create(self, model, messages, **kwargs):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        return _completion(model, reply, _usage(messages, reply))
+
+    async def _create_async(self, model, messages, **kwargs):
+        await asyncio.sleep(0)
+        return self._create(model, messages, **kwargs)
+
+
+def json_client(replies, use_async=False, **kwargs):
+    kwargs.setdefault("retry_policy", RetryPolicy(base_delay=0, jitter=False))
+    api = UnifiedApis(
+        provider="local",
+        json_mode=True,
+        stream=False,
+        use_async=use_async,
+        sink=None,
+        should_print_init=False,
+        **kwargs,
+    )
+    api.client = ScriptedClient(replies, use_async)
+    return api
+
+
+def test_malformed_json_is_not_cached():
+    cache = ResponseCache()
+    api = json_client(['{"a": 1'], response_cache=cache, retry_policy=RetryPolicy(max_retries=0))
+    with pytest.raises(Exception):
+        api.chat("question")
+    # The same request again goes to the provider instead of replaying the bad reply
+    again = json_client(['{"a": 1}'], response_cache=cache)
+    assert again.chat("question") == {"a": 1}
+    assert again.client.calls == 1
+
+
+def test_unparseable_cache_entry_is_dropped():
+    cache = ResponseCache()
+    api = json_client(['{"a": 2}'], response_cache=cache)
+    api.add_message("user", "question")
+    key = api._request_key(None, None, {})
+    api.clear_history()
+    cache.set(key, '{"a": 2')
+    assert api.chat("question") == {"a": 2}
+    assert api.client.calls == 1
+    assert json.loads(cache.get(key)) == {"a": 2}
+
+
+def test_async_malformed_json_is_retried():
+    api = json_client(['{"a": 1', '{"a": 1}'], use_async=True)
+    assert asyncio.run(api.chat_async("question")) == {"a": 1}
+    assert api.client.calls == 2
+
+
+def test_coalesced_callers_share_one_parsed_reply():
+    from single_flight import SingleFlight
+
+    async def ask_twice():
+        api = json_client(['{"a": 1', '{"a": [1]}'], use_async=True, single_flight=SingleFlight())
+        first, second = api.fork(), api.fork()
+        results = await asyncio.gather(first.chat_async("question"), second.chat_async("question"))
+        return api.client.calls, results
+
+    calls, (first, second) = asyncio.run(ask_twice())
+    # One upstream call retried once, and both callers get the parsed reply
+    assert calls == 2
+    assert first == second == {"a": [1]}
+    assert first is not second
+
+
+def test_conversation_copy_keeps_totals(monkeypatch):
+    import unified
+
+    conversation = unified.Conversation()
+    for role in ("user", "assistant", "user"):
+        conversation.add({"role": role, "content": "a few words here"})
+    monkeypatch.setattr(unified, "count_tokens", lambda text: pytest.fail("copy tokenized the history"))
+    copied = conversation.copy()
+    assert (copied.words, copied.tokens) == (conversation.words, conversation.tokens)
+    copied.pop_oldest()
+    assert copied.words == conversation.words - 4
+    assert len(conversation.history) == 3
+
+
+def parse_json_response(reply):
+    # Like the app's parser: the JSON object somewhere in a reply from a model without JSON mode
+    return json.loads(reply[reply.find("{"):])
+
+
+def test_reply_parser_failure_is_not_cached():
+    cache = ResponseCache()
+    api = json_client(
+        ["Sorry, I can't help with that."],
+        response_cache=cache,
+        retry_policy=RetryPolicy(max_retries=0),
+    )
+    api.json_mode = False
+    api.reply_parser = parse_json_response
+    with pytest.raises(Exception):
+        api.chat("question")
+    again = json_client(['Here it is: {"a": 1}'], response_cache=cache)
+    again.json_mode = False
+    again.reply_parser = parse_json_response
+    assert again.chat("question") == {"a": 1}
+    assert again.client.calls == 1
+
+
+def test_cancelled_trial_call_releases_the_breaker():
+    from retry import CircuitBreaker
+
+    async def cancel_trial():
+        api = json_client(['{"a": 1}'], use_async=True)
+        api.circuit_breaker = CircuitBreaker("test", reset_timeout=0)
+        api.circuit_breaker.state = "open"
+        started = asyncio.Event()
+        create = api.client.chat.completions.create
+
+        async def slow_create(**kwargs):
+            started.set()
+            await asyncio.sleep(10)
+            return await create(**kwargs)
+
+        api.client.chat.completions.create = slow_create
+        task = asyncio.ensure_future(api.chat_async("question"))
+        await started.wait()
+        assert api.circuit_breaker.state == "half_open"
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return api.circuit_breaker.state
+
+    assert asyncio.run(cancel_trial()) == "open"
+
+
+def test_hedge_backup_is_recorded_as_its_own_call():
+    from hedging import HedgePolicy
+    from local_provider import AsyncLocalClient
+    from telemetry import Telemetry
+
+    def streaming_client(model, ttft, **kwargs):
+        api = UnifiedApis(provider="local", model=model, use_async=True, sink=None, should_print_init=False, **kwargs)
+        api.client = AsyncLocalClient(ttft=ttft)
+        return api
+
+    telemetry = Telemetry()
+    backup = streaming_client("local/backup", 0)
+    primary = streaming_client("local/primary", 5, telemetry=telemetry, hedge=HedgePolicy(backup, delay=0.01))
+    reply = asyncio.run(primary.chat_async("question"))
+
+    records = {record["model"]: record for record in telemetry.records}
+    assert records["local/primary"]["hedge_winner"] == "backup"
+    assert records["local/primary"]["output_tokens"] == 0
+    assert records["local/backup"]["status"] == "ok"
+    assert records["local/backup"]["output_tokens"] > 0
+    assert records["local/backup"]["stage"] == records["local/primary"]["stage"]
+    assert reply
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_stopping_stream_early_cancels_the_request(use_async):
+    import time
+
+    from local_provider import AsyncLocalClient, LocalClient
+    from telemetry import Telemetry
+
+    telemetry = Telemetry()
+    api = UnifiedApis(provider="local", use_async=use_async, sink=None, telemetry=telemetry, should_print_init=False)
+    api.client = (AsyncLocalClient if use_async else LocalClient)(tokens_per_second=50)
+    events = api.stream("question")
+    assert next(events)["type"] == "delta"
+    events.close()
+    deadline = time.monotonic() + 5
+    while not telemetry.records and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert telemetry.records[-1]["status"] == "cancelled"
+    assert [message["role"] for message in api.history] == ["user"]
+
+
+def test_stream_yields_deltas_then_usage():
+    from local_provider import LocalClient
+
+    api = UnifiedApis(provider="local", sink=None, should_print_init=False)
+    api.client = LocalClient()
+    events = list(api.stream("question"))
+    assert events[-1]["type"] == "usage" and events[-1]["output_tokens"] > 0
+    assert "".join(event["text"] for event in events[:-1]) == api.history[-1]["content"]
+
+
+def test_cached_claude_request_goes_through_the_messages_api():
+    anthropic = pytest.importorskip("anthropic")
+    try:
+        # The HTTP client newer SDKs are built on
+        import httpx2 as httpx
+    except ImportError:
+        httpx = pytest.importorskip("httpx")
+    sent = []
+
+    def handler(request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "id": "msg_1",
+            "type": "message",
+            "role": "assistant",
+            "model": "claude-3-5-sonnet-20240620",
+            "content": [{"type": "text", "text": "An answer."}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": 3, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 10},
+        })
+
+    api = UnifiedApis(
+        provider="anthropic",
+        api_key="test",
+        stream=False,
+        use_cache=True,
+        cache_breakpoints="auto",
+        sink=None,
+        should_print_init=False,
+    )
+    api.client = anthropic.Anthropic(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.set_system_message("A static stage prompt.")
+    api.chat("First question")
+    assert api.chat("Second question") == "An answer."
+
+    body = sent[-1]
+    assert body["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert body["messages"][-2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert api.last_call["cache_write_tokens"] == 10
@@ -1,20 +1,249 @@
 import os
+import copy
 import json
-from openai import OpenAI
-from anthropic import Anthropic
-from openai import AsyncOpenAI
-from anthropic import AsyncAnthropic
 from termcolor import colored
 import time
 import asyncio
-from pydantic import BaseModel
+import threading
+import queue
+import concurrent.futures
+from collections import deque
+import weakref
+from pydantic import BaseModel, ValidationError
+from retry import RetryPolicy, RetryError, get_circuit_breaker, is_retryable
+from scheduler import ProviderScheduler, PRIORITY_DEFAULT
+from local_provider import LocalClient, AsyncLocalClient
+from telemetry import TOKEN_FIELDS, new_call
+from response_cache import ResponseCache
+from background_loop import get_background_loop
 from typing import Any, Optional
 
+# SDK clients are heavyweight (connection pools, TLS sessions), so they are shared by every
+# UnifiedApis instance with the same provider and key. Async clients are bound to the event
+# loop they were first used on, so they are pooled per loop.
+_sync_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _create_client(provider, api_key, use_async):
+    # The SDKs' own retries are turned off, retries are handled by UnifiedApis.retry_policy.
+    # They are imported here rather than at module level: importing them takes longer than
+    # everything else the app loads, and a process only needs the providers it calls.
+    if provider == "openai" and use_async:
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=api_key, max_retries=0)
+    elif provider == "anthropic" and use_async:
+        from anthropic import AsyncAnthropic
+        return AsyncAnthropic(api_key=api_key, max_retries=0)
+    elif provider == "openrouter" and use_async:
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=api_key,
+            max_retries=0
+        )
+    elif provider == "local" and use_async:
+        return AsyncLocalClient()
+    elif provider == "openai" and not use_async:
+        from openai import OpenAI
+        return OpenAI(api_key=api_key, max_retries=0)
+    elif provider == "anthropic" and not use_async:
+        from anthropic import Anthropic
+        return Anthropic(api_key=api_key, max_retries=0)
+    elif provider == "openrouter" and not use_async:
+        from openai import OpenAI
+        return OpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=api_key,
+            max_retries=0
+        )
+    elif provider == "local" and not use_async:
+        return LocalClient()
+    raise ValueError(f"Unsupported provider: {provider}")
+
+
+def get_shared_client(provider, api_key, use_async):
+    key = (provider, api_key)
+    with _client_lock:
+        if not use_async:
+            if key not in _sync_clients:
+                _sync_clients[key] = _create_client(provider, api_key, use_async)
+            return _sync_clients[key]
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            # Not inside a loop yet: hand out an unbound client, it gets bound on first use
+            return _create_client(provider, api_key, use_async)
+        loop_clients = _async_clients.setdefault(loop, {})
+        if key not in loop_clients:
+            loop_clients[key] = _create_client(provider, api_key, use_async)
+        return loop_clients[key]
+
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # Loaded on first use; building the BPE ranks is slow and may fetch them from the network
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _encoding if _encoding_loaded else _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Rough estimate when tiktoken isn't installed: about 4 characters per token
+    return (len(text) + 3) // 4
+
+
+def message_text(message):
+    content = message["content"]
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+class Conversation:
+    """Message history of a single conversation, kept separate from the SDK client.
+
+    Word and token totals are updated as messages are added and removed, so trimming
+    never rescans the history.
+    """
+
+    def __init__(self, max_history_words=10000, max_history_tokens=None):
+        self.max_history_words = max_history_words
+        self.max_history_tokens = max_history_tokens
+        self.history = deque()
+        self.turn = 1
+        self.words = 0
+        self.tokens = 0
+        self._sizes = deque()
+        self._cache_marked = []
+        # Messages removed from the front so far, so positions stay comparable across copies
+        self.dropped = 0
+        # RollingSummary of the oldest messages, set by a ConversationSummarizer and shared with copies
+        self.summary = None
+
+    def add(self, message):
+        text = message_text(message)
+        size = (len(text.split()), count_tokens(text)) if message["role"] != "system" else (0, 0)
+        self.history.append(message)
+        self._sizes.append(size)
+        self.words += size[0]
+        self.tokens += size[1]
+        if isinstance(message["content"], list):
+            self._cache_marked.append(message)
+        self.turn += 1
+
+    def pop_oldest(self):
+        message = self.history.popleft()
+        words, tokens = self._sizes.popleft()
+        self.words -= words
+        self.tokens -= tokens
+        self.dropped += 1
+        return message
+
+    def clear(self):
+        self.dropped += len(self.history)
+        self.summary = None
+        self.history.clear()
+        self._sizes.clear()
+        self._cache_marked.clear()
+        self.words = 0
+        self.tokens = 0
+
+    def copy(self):
+        # Independent copy of the messages, e.g. to continue the conversation on another provider
+        # The sizes and totals are carried over, so copying doesn't tokenize the history again
+        copied = Conversation(self.max_history_words, self.max_history_tokens)
+        copied.history = copy.deepcopy(self.history)
+        copied._sizes = deque(self._sizes)
+        copied.words = self.words
+        copied.tokens = self.tokens
+        copied._cache_marked = [message for message in copied.history if isinstance(message["content"], list)]
+        copied.turn = self.turn
+        copied.dropped = self.dropped
+        copied.summary = self.summary
+        return copied
+
+    def word_count(self):
+        return self.words
+
+    def token_count(self):
+        return self.tokens
+
+    def over_budget(self):
+        if self.max_history_words is not None and self.words > self.max_history_words:
+            return True
+        return self.max_history_tokens is not None and self.tokens > self.max_history_tokens
+
+    def trim(self):
+        while self.over_budget() and len(self.history) > 1:
+            self.pop_oldest()
+        # Anthropic rejects a history that starts with an assistant message
+        while self.history and self.history[0]["role"] == "assistant":
+            self.pop_oldest()
+
+    def summary_text(self):
+        return self.summary.text if self.summary is not None else ""
+
+    def fold(self):
+        # Drops the messages the summary has taken in since the last request
+        if self.summary is None:
+            return
+        covers = self.summary.covers
+        while self.history and self.dropped < covers:
+            self.pop_oldest()
+
+    def remove_cache_keys(self):
+        # Only messages added with cache_control are visited, instead of the whole history
+        for message in self._cache_marked:
+            message["content"][0].pop("cache_control", None)
+        self._cache_marked.clear()
+
+
+class TerminalSink:
+    """Echoes streamed replies to stdout as they arrive, each chunk in the caller's color."""
+
+    def write(self, content, color):
+        print(colored(content, color), end="", flush=True)
+
+    def end(self):
+        print()
+
+
+# UNIFIED_SERVER_MODE=1 turns the terminal echo off by default: a server has no one reading
+# its stdout, and a synchronous write per token stalls the event loop
+SERVER_MODE = os.getenv("UNIFIED_SERVER_MODE") == "1"
+_DEFAULT_SINK = object()
+
+
+class InvalidResponse(ValueError):
+    def __init__(self, raw_response, error):
+        super().__init__(f"Response failed validation: {error}")
+        self.raw_response = raw_response
+        self.error = error
+
+
 class UnifiedApis:
     def __init__(self,
                  name="Unified Apis",
                  api_key=None,
                  max_history_words=10000,
+                 max_history_tokens=None,
                  max_words_per_message=None,
                  json_mode=False,
                  stream=True,
@@ -26,7 +255,23 @@ class UnifiedApis:
                  print_color="green",
                  use_cache=False,
                  cache_interval=10,
-                 print_cache_usage=False
+                 cache_breakpoints="interval",
+                 print_cache_usage=False,
+                 conversation=None,
+                 response_cache=None,
+                 max_validation_retries=2,
+                 retry_policy=None,
+                 max_concurrency=None,
+                 scheduler=None,
+                 priority=PRIORITY_DEFAULT,
+                 session_id=None,
+                 telemetry=None,
+                 stage=None,
+                 single_flight=None,
+                 hedge=None,
+                 sink=_DEFAULT_SINK,
+                 summarizer=None,
+                 reply_parser=None
                  ):
         
         self.provider = provider.lower()
@@ -36,28 +281,66 @@ class UnifiedApis:
             self.model = model or "claude-3-5-sonnet-20240620"
         elif self.provider == "openrouter":
             self.model = model or "google/gemini-pro-1.5"
+        elif self.provider == "local":
+            self.model = model or "local"
         self.name = name
         self.api_key = api_key or self._get_api_key()
-        self.history = []
-        self.max_history_words = max_history_words
+        self.conversation = conversation or Conversation(max_history_words, max_history_tokens)
         self.max_words_per_message = max_words_per_message
         self.json_mode = json_mode
-        self.stream = stream
+        # Not self.stream, which would hide the stream() method
+        self.streaming = stream
         self.use_async = use_async
         self.max_retry = max_retry
+        # max_retry counts attempts, the policy counts retries after the first attempt
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=max_retry - 1)
+        self.circuit_breaker = get_circuit_breaker(self.provider)
+        # Admission control for async requests, shared by every fork of this instance. Calls are
+        # served by priority and round-robin across session ids; max_concurrency alone gives a
+        # private scheduler with only a concurrency cap.
+        if scheduler is None and max_concurrency:
+            scheduler = ProviderScheduler(max_concurrency=max_concurrency, name=f"{self.provider}/{self.model}")
+        self.scheduler = scheduler
+        self.priority = priority
+        self.session_id = session_id
+        # Every request is recorded on telemetry (if given) under this stage label
+        self.telemetry = telemetry
+        self.stage = stage
+        # Identical async requests in flight at the same time share one upstream call
+        self.single_flight = single_flight
+        # Optional HedgePolicy: streamed async replies whose first token is late are raced against a backup provider
+        self.hedge = hedge
+        # Where streamed text is echoed (anything with write(content, color) and end()); None echoes nothing
+        if sink is _DEFAULT_SINK:
+            sink = None if SERVER_MODE else TerminalSink()
+        self.sink = sink
+        # Optional ConversationSummarizer: once the history is over its budget, the oldest turns
+        # are folded into a running summary sent after the system message
+        self.summarizer = summarizer
+        # Optional callable that turns a text reply into the result; a ValueError from it fails the
+        # attempt like invalid JSON does, so the reply is neither cached nor added to the history
+        self.reply_parser = reply_parser
+        self.last_call = None
         self.print_color = print_color
         self.system_message = "You are a helpful assistant."
-        if self.provider == "openai" and self.json_mode:
+        if self.provider in ("openai", "local") and self.json_mode:
             self.system_message += " Please return your response in JSON unless user has specified a system message."
         self.use_cache = use_cache
         self.cache_interval = cache_interval
-        self.turn = 1
+        # With use_cache on Anthropic: "interval" marks every cache_interval-th message as it is
+        # added, "auto" marks the system message and the last message before the newest user
+        # turn on each request, so the whole conversation so far is the reusable prefix
+        self.cache_breakpoints = cache_breakpoints
+        # Context sent with the newest user message but not kept in the history, see chat()
+        self.turn_context = None
         self.print_cache_usage = print_cache_usage
+        self.response_cache = response_cache
+        self.max_validation_retries = max_validation_retries
 
         self._initialize_client()
 
         if should_print_init:
-            print(colored(f"{self.name} initialized with provider={self.provider}, model={self.model}, json_mode={json_mode}, stream={stream}, use_async={use_async}, max_history_words={max_history_words}, max_words_per_message={max_words_per_message}, use_cache={use_cache}, cache_interval={cache_interval}, print_cache_usage={print_cache_usage}", "red"))
+            print(colored(f"{self.name} initialized with provider={self.provider}, model={self.model}, json_mode={json_mode}, stream={stream}, use_async={use_async}, max_history_words={max_history_words}, max_history_tokens={max_history_tokens}, max_words_per_message={max_words_per_message}, use_cache={use_cache}, cache_interval={cache_interval}, print_cache_usage={print_cache_usage}", "red"))
 
     def _get_api_key(self):
         if self.provider == "openai":
@@ -66,32 +349,60 @@ class UnifiedApis:
             return os.getenv("ANTHROPIC_API_KEY") or "YOUR_ANTHROPIC_KEY_HERE"
         elif self.provider == "openrouter":
             return os.getenv("OPENROUTER_API_KEY") or "YOUR_OPENROUTER_KEY_HERE"
+        elif self.provider == "local":
+            return "local"
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
 
     def _initialize_client(self):
-        if self.provider == "openai" and self.use_async:
-            self.client = AsyncOpenAI(api_key=self.api_key)
-        elif self.provider == "anthropic" and self.use_async:
-            self.client = AsyncAnthropic(api_key=self.api_key)
-        elif self.provider == "openrouter" and self.use_async:
-            self.client = AsyncOpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=self.api_key
-            )
-        elif self.provider == "openai" and not self.use_async:
-            self.client = OpenAI(api_key=self.api_key)
-        elif self.provider == "anthropic" and not self.use_async:
-            self.client = Anthropic(api_key=self.api_key)
-        elif self.provider == "openrouter" and not self.use_async:
-            self.client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=self.api_key
-            )
+        # Nothing is created until the first request, see the client property
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is not None:
+            return self._client
+        # Resolved per call so each event loop gets its own pooled async client
+        return get_shared_client(self.provider, self.api_key, self.use_async)
+
+    def warm_up(self):
+        """Creates the pooled SDK client ahead of the first request.
+
+        Async clients are pooled per event loop, so call this on the loop that will make the requests.
+        """
+        return self.client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def history(self):
+        return self.conversation.history
+
+    @property
+    def turn(self):
+        return self.conversation.turn
+
+    @property
+    def max_history_words(self):
+        return self.conversation.max_history_words
+
+    @max_history_words.setter
+    def max_history_words(self, value):
+        self.conversation.max_history_words = value
+
+    @property
+    def max_history_tokens(self):
+        return self.conversation.max_history_tokens
+
+    @max_history_tokens.setter
+    def max_history_tokens(self, value):
+        self.conversation.max_history_tokens = value
 
     def set_system_message(self, message=None):
         self.system_message = message or "You are a helpful assistant."
-        if self.provider == "openai" and self.json_mode and "json" not in message.lower():
+        if self.provider in ("openai", "local") and self.json_mode and "json" not in message.lower():
             self.system_message += " Please return your response in JSON unless user has specified a system message."
         
         if self.use_cache:
@@ -110,258 +421,695 @@ class UnifiedApis:
         
         message = {"role": role, "content": str(content)}
         
-        if self.use_cache and self.turn % self.cache_interval == 0:
+        if self.use_cache and self.cache_breakpoints == "interval" and self.turn % self.cache_interval == 0:
             if isinstance(message["content"], str):
                 message["content"] = [{"type": "text", "text": message["content"]}]
             message["content"][0]["cache_control"] = {"type": "ephemeral"}
         
-        self.history.append(message)
-        self.turn += 1
+        self.conversation.add(message)
 
     async def add_message_async(self, role, content):
         self.add_message(role, content)
 
     def print_history_length(self):
-        history_length = sum(len(str(message["content"]).split()) for message in self.history)
-        print(f"\nCurrent history length is {history_length} words")
+        print(f"\nCurrent history length is {self.conversation.word_count()} words ({self.conversation.token_count()} tokens)")
 
     async def print_history_length_async(self):
         self.print_history_length()
 
     def clear_history(self):
-        self.history.clear()
+        self.conversation.clear()
 
     async def clear_history_async(self):
         self.clear_history()
 
-    def chat(self, user_input, response_model: Optional[BaseModel] = None, **kwargs):
+    def fork(self, name=None, max_history_words=None, max_history_tokens=None, session_id=None, stage=None):
+        # Shares the SDK client but starts an empty conversation, so concurrent callers don't interleave messages
+        forked = copy.copy(self)
+        forked.name = name or self.name
+        forked.session_id = session_id or self.session_id
+        forked.stage = stage or self.stage
+        forked.turn_context = None
+        forked.conversation = Conversation(
+            max_history_words or self.max_history_words,
+            max_history_tokens or self.max_history_tokens
+        )
+        return forked
+
+    def chat(self, user_input, response_model: Optional[BaseModel] = None, context=None, **kwargs):
+        # context goes in front of user_input for this request only; the history keeps user_input,
+        # so what was sent before stays an unchanged, cacheable prefix of the next request
         self.add_message("user", user_input)
+        self.turn_context = context
         return self.get_response(response_model=response_model, **kwargs)
 
-    async def chat_async(self, user_input, response_model: Optional[BaseModel] = None, **kwargs):
+    async def chat_async(self, user_input, response_model: Optional[BaseModel] = None, context=None, **kwargs):
         await self.add_message_async("user", user_input)
+        self.turn_context = context
         return await self.get_response_async(response_model=response_model, **kwargs)
 
     def trim_history(self):
-        words_count = sum(len(str(message["content"]).split()) for message in self.history if message["role"] != "system")
-        while words_count > self.max_history_words and len(self.history) > 1:
-            words_count -= len(self.history[0]["content"].split())
-            self.history.pop(0)
+        self.conversation.trim()
 
     async def trim_history_async(self):
         self.trim_history()
 
     def remove_previous_cache_keys(self):
+        self.conversation.remove_cache_keys()
+
+    def _system_text(self):
+        return self.system_message["text"] if isinstance(self.system_message, dict) else self.system_message
+
+    def _summary_message(self):
+        summary = self.conversation.summary_text()
+        return f"Summary of the earlier conversation:\n{summary}" if summary else None
+
+    def _openai_messages(self):
+        messages = [{"role": "system", "content": self._system_text()}]
+        summary = self._summary_message()
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        return [*messages, *self._request_history()]
+
+    def _request_history(self):
+        # The history as sent: the newest user message carries this turn's context
+        messages = list(self.history)
+        if self.turn_context and messages and messages[-1]["role"] == "user":
+            messages[-1] = {**messages[-1], "content": f"{self.turn_context}\n\n{message_text(messages[-1])}"}
+        return messages
+
+    def _anthropic_prompt(self):
+        messages = self._request_history()
+        summary = self._summary_message()
+        if not self.use_cache:
+            return (f"{self.system_message}\n\n{summary}" if summary else self.system_message), messages
+        system = self.system_message
+        if not isinstance(system, dict):
+            system = {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}
+        system = [system]
+        if summary:
+            # Only changes when more turns are folded, so in "auto" mode it gets its own breakpoint
+            block = {"type": "text", "text": summary}
+            if self.cache_breakpoints == "auto":
+                block["cache_control"] = {"type": "ephemeral"}
+            system.append(block)
+        if self.cache_breakpoints == "auto" and len(messages) > 1:
+            # Marked on a copy, the history itself keeps plain messages
+            stable = messages[-2]
+            blocks = stable["content"] if isinstance(stable["content"], list) else [{"type": "text", "text": stable["content"]}]
+            messages[-2] = {**stable, "content": [*blocks[:-1], {**blocks[-1], "cache_control": {"type": "ephemeral"}}]}
+        return system, messages
+
+    def _build_request(self, response_model, max_tokens, kwargs):
+        # Returns the SDK method to call and its arguments. Sync and async SDK clients expose the
+        # same methods, so this is shared by get_response and get_response_async.
+        if self.provider == "openai":
+            if response_model:
+                return self.client.beta.chat.completions.parse, dict(
+                    model=self.model,
+                    messages=self._openai_messages(),
+                    max_tokens=max_tokens or 4000,
+                    response_format=response_model,
+                    **kwargs
+                )
+            params = dict(
+                model=self.model,
+                messages=self._openai_messages(),
+                stream=self.streaming,
+                max_tokens=max_tokens or 4000,
+                response_format={"type": "json_object"} if self.json_mode else None,
+                **kwargs
+            )
+            if self.streaming:
+                # Makes the last chunk carry the token usage
+                params.setdefault("stream_options", {"include_usage": True})
+            return self.client.chat.completions.create, params
+        elif self.provider == "anthropic":
+            # Prompt caching is part of the Messages API: cache_control blocks go to messages.create
+            method = self.client.messages.create
+            system, messages = self._anthropic_prompt()
+            params = dict(
+                model=self.model,
+                system=system,
+                messages=messages,
+                stream=self._is_streaming(response_model),
+                max_tokens=max_tokens or 8192,
+                extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
+                **kwargs
+            )
+            if response_model:
+                # Structured output through a single forced tool call whose input is the schema
+                params["tools"] = [{
+                    "name": response_model.__name__,
+                    "description": f"Return the answer as a {response_model.__name__} object.",
+                    "input_schema": response_model.model_json_schema(),
+                }]
+                params["tool_choice"] = {"type": "tool", "name": response_model.__name__}
+            return method, params
+        elif self.provider in ("openrouter", "local"):
+            params = dict(
+                model=self.model,
+                messages=self._openai_messages(),
+                stream=self._is_streaming(response_model),
+                max_tokens=max_tokens or 4000,
+                **kwargs
+            )
+            if response_model:
+                params["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": response_model.__name__,
+                        "schema": response_model.model_json_schema(),
+                    },
+                }
+            elif self.json_mode and self.provider == "local":
+                params["response_format"] = {"type": "json_object"}
+            if self.provider == "local" and params["stream"]:
+                params.setdefault("stream_options", {"include_usage": True})
+            return self.client.chat.completions.create, params
+        raise ValueError(f"Unsupported provider: {self.provider}")
+
+    def _is_streaming(self, response_model):
+        return self.streaming and not response_model
+
+    def _chunk_content(self, chunk):
+        if self.provider in ("openai", "openrouter", "local"):
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+            return None
+        elif self.provider == "anthropic":
+            return chunk.delta.text if chunk.type == 'content_block_delta' else None
+
+    def _response_content(self, response, response_model):
+        if response_model and self.provider == "openai":
+            return response.choices[0].message.parsed
+        if self.provider in ("openai", "openrouter", "local"):
+            assistant_response = response.choices[0].message.content
+        elif self.provider == "anthropic" and response_model:
+            tool_inputs = [block.input for block in response.content if block.type == "tool_use"]
+            assistant_response = json.dumps(tool_inputs[0]) if tool_inputs else response.content[0].text
+        elif self.provider == "anthropic":
+            assistant_response = response.content[0].text
+        if response_model:
+            try:
+                return response_model.model_validate_json(assistant_response)
+            except ValidationError as e:
+                raise InvalidResponse(assistant_response, e)
+        return assistant_response
+
+    def _read_usage(self, obj):
+        # Token usage from a response or a stream event, keyed like the telemetry record fields
+        if self.provider == "anthropic":
+            event_type = getattr(obj, "type", None)
+            if event_type == "message_start":
+                obj = obj.message
+            usage = getattr(obj, "usage", None)
+            if usage is None:
+                return {}
+            found = {"output_tokens": getattr(usage, "output_tokens", None)}
+            if event_type != "message_delta":
+                found["input_tokens"] = getattr(usage, "input_tokens", None)
+                found["cache_read_tokens"] = getattr(usage, "cache_read_input_tokens", None)
+                found["cache_write_tokens"] = getattr(usage, "cache_creation_input_tokens", None)
+        else:
+            usage = getattr(obj, "usage", None)
+            if usage is None:
+                return {}
+            details = getattr(usage, "prompt_tokens_details", None)
+            found = {
+                "input_tokens": getattr(usage, "prompt_tokens", None),
+                "output_tokens": getattr(usage, "completion_tokens", None),
+                "cache_read_tokens": getattr(details, "cached_tokens", None),
+            }
+        return {key: value for key, value in found.items() if isinstance(value, int)}
+
+    def _add_usage(self, call, usage):
+        for key, value in usage.items():
+            call[key] += value
+        if usage and self.use_cache and self.provider == "anthropic" and self.print_cache_usage:
+            print(colored("\nCache Usage:", "yellow"))
+            print(colored(f"Input tokens: {usage.get('input_tokens', 0)}", "yellow"))
+            print(colored(f"Cache creation input tokens: {usage.get('cache_write_tokens', 0)}", "yellow"))
+            print(colored(f"Cache read input tokens: {usage.get('cache_read_tokens', 0)}", "yellow"))
+            print(colored(f"Output tokens: {usage.get('output_tokens', 0)}", "yellow"))
+
+    def _start_call(self):
+        call = new_call(self.provider, self.model, self.stage, self.session_id)
+        call["_start"] = time.perf_counter()
+        return call
+
+    def _first_token(self, call):
+        if call["ttft"] is None:
+            call["ttft"] = time.perf_counter() - call["_start"]
+
+    def _end_call(self, call, error=None):
+        call["duration"] = time.perf_counter() - call["_start"]
+        if error is not None:
+            # GeneratorExit: a stream closed by its reader, e.g. the losing side of a hedge
+            call["status"] = "cancelled" if isinstance(error, (asyncio.CancelledError, GeneratorExit)) else "error"
+            call["error"] = f"{type(error).__name__}: {error}"
+        # A snapshot, since a shared in-flight request may still update the call after its caller left
+        self.last_call = {key: value for key, value in call.items() if key != "_start"}
+        if self.telemetry is not None:
+            self.telemetry.record(self.last_call)
+
+    def _ask_to_fix(self, error):
+        # Keeps the failed answer in the conversation and asks again with the validation error,
+        # so only this call is repeated rather than everything that led up to it
+        self.add_message("assistant", error.raw_response)
+        self.add_message("user", f"Your previous answer did not match the required schema:\n{error.error}\nPlease answer again with every required field filled in.")
+
+    def _emit_chunk(self, content, color, should_print, on_chunk):
+        if should_print and self.sink is not None:
+            self.sink.write(content, color)
+        if on_chunk:
+            on_chunk(content)
+
+    def _end_stream(self, should_print):
+        if should_print and self.sink is not None:
+            self.sink.end()
+
+    def _parse_response(self, assistant_response, response_model):
+        # Raises on a reply that isn't valid JSON, so it is never cached or added to the history
+        if response_model:
+            return assistant_response
+        if self.reply_parser is not None:
+            return self.reply_parser(assistant_response)
+        if self.json_mode and self.provider in ("openai", "local"):
+            return json.loads(assistant_response)
+        return assistant_response
+
+    def _finish_response(self, assistant_response, response_model):
+        self.add_message("assistant", str(assistant_response))
+        self.turn_context = None
+        self.trim_history()
+        if self.summarizer is not None:
+            self.summarizer.schedule(self.conversation, self.session_id)
+        return assistant_response
+
+    def _request_key(self, response_model, max_tokens, kwargs):
+        return ResponseCache.make_key(
+            provider=self.provider,
+            model=self.model,
+            system=self.system_message,
+            summary=self.conversation.summary_text(),
+            messages=list(self.history),
+            context=self.turn_context,
+            json_mode=self.json_mode,
+            response_model=response_model.model_json_schema() if response_model else None,
+            max_tokens=max_tokens,
+            params=kwargs,
+        )
+
+    def _cached_response(self, cache_key, response_model, color, should_print, on_chunk):
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            return None
+        try:
+            if response_model:
+                return self._finish_response(response_model.model_validate_json(cached), response_model)
+            parsed = self._parse_response(cached, response_model)
+        except ValueError:
+            # An entry that no longer parses is dropped and the request is made again
+            self.response_cache.delete(cache_key)
+            return None
+        if self._is_streaming(response_model):
+            # Replayed through the same path as a live stream so streaming callers see the same output
+            self._emit_chunk(cached, color, should_print, on_chunk)
+            self._end_stream(should_print)
+        elif on_chunk:
+            on_chunk(cached)
+        return self._finish_response(parsed, response_model)
+
+    def _store_response(self, cache_key, assistant_response, response_model):
+        if response_model:
+            self.response_cache.set(cache_key, assistant_response.model_dump_json())
+        else:
+            self.response_cache.set(cache_key, assistant_response)
+
+    def _estimate_tokens(self, max_tokens):
+        # Prompt plus the most the reply can use, which is what providers count against token limits
+        prompt = count_tokens(self._system_text()) + count_tokens(self.turn_context or "")
+        if self.conversation.summary is not None:
+            prompt += self.conversation.summary.tokens
+        default_max_tokens = 8192 if self.provider == "anthropic" else 4000
+        return self.conversation.token_count() + prompt + (max_tokens or default_max_tokens)
+
+    def scheduler_stats(self):
+        return self.scheduler.stats() if self.scheduler is not None else {}
+
+    def _retry_delay(self, error, retries):
+        delay = self.retry_policy.next_delay(error, retries)
+        if delay is None:
+            if is_retryable(error):
+                raise RetryError("Max retries reached") from error
+            raise error
+        return delay
+
+    def retry_stats(self):
+        return {
+            **self.retry_policy.stats,
+            "circuit_state": self.circuit_breaker.state,
+            **{f"circuit_{name}": count for name, count in self.circuit_breaker.stats.items()},
+        }
+
+    def _attempt(self, call, response_model, max_tokens, kwargs, color, should_print, on_chunk):
+        method, params = self._build_request(response_model, max_tokens, kwargs)
+        response = method(**params)
+
+        usage = {}
+        try:
+            if self._is_streaming(response_model):
+                # Joined once at the end; appending to a string copies the reply so far per chunk
+                parts = []
+                for chunk in response:
+                    content = self._chunk_content(chunk)
+                    if content:
+                        if call["ttft"] is None:
+                            self._first_token(call)
+                        self._emit_chunk(content, color, should_print, on_chunk)
+                        parts.append(content)
+                    else:
+                        usage.update(self._read_usage(chunk))
+                self._end_stream(should_print)
+                assistant_response = "".join(parts)
+            else:
+                self._first_token(call)
+                usage = self._read_usage(response)
+                assistant_response = self._response_content(response, response_model)
+                if on_chunk and isinstance(assistant_response, str):
+                    on_chunk(assistant_response)
+        finally:
+            self._add_usage(call, usage)
+        return assistant_response
+
+    async def _attempt_async(self, call, response_model, max_tokens, kwargs, color, should_print, on_chunk):
+        if self._is_streaming(response_model):
+            contents = self._stream_async(call, response_model, max_tokens, kwargs)
+            if self.hedge is not None:
+                contents, call["hedge_winner"] = await self.hedge.race(contents, lambda: self._hedge_stream(call, max_tokens, kwargs))
+            parts = []
+            async for content in contents:
+                if call["ttft"] is None:
+                    self._first_token(call)
+                self._emit_chunk(content, color, should_print, on_chunk)
+                parts.append(content)
+            self._end_stream(should_print)
+            return "".join(parts)
+
+        method, params = self._build_request(response_model, max_tokens, kwargs)
+        response = await method(**params)
+        self._first_token(call)
+        usage = self._read_usage(response)
+        try:
+            assistant_response = self._response_content(response, response_model)
+            if on_chunk and isinstance(assistant_response, str):
+                on_chunk(assistant_response)
+        finally:
+            self._add_usage(call, usage)
+        return assistant_response
+
+    async def _stream_async(self, call, response_model, max_tokens, kwargs):
+        # The content pieces of one streamed reply; its token usage is added to the call when the stream ends
+        method, params = self._build_request(response_model, max_tokens, kwargs)
+        response = await method(**params)
+        usage = {}
+        try:
+            async for chunk in response:
+                content = self._chunk_content(chunk)
+                if content:
+                    yield content
+                else:
+                    usage.update(self._read_usage(chunk))
+        except BaseException:
+            # Abandoned or cancelled (e.g. it lost a hedge): close the connection instead of reading the rest
+            close = getattr(response, "close", None) or getattr(response, "aclose", None)
+            if close is not None:
+                await close()
+            raise
+        finally:
+            self._add_usage(call, usage)
+
+    async def _hedge_stream(self, call, max_tokens, kwargs):
+        # The same conversation sent to the backup provider, under that provider's own limits
+        backup = self.hedge.backup.fork(session_id=self.session_id, stage=self.stage)
+        backup.system_message = self._system_text()
         for message in self.history:
-            if isinstance(message["content"], list) and "cache_control" in message["content"][0]:
-                del message["content"][0]["cache_control"]
+            backup.conversation.add(copy.deepcopy(message))
+        backup.conversation.summary = self.conversation.summary
+        backup.turn_context = self.turn_context
+        # Recorded as a call of its own, so its tokens and timings count for the backup's provider and model
+        backup.telemetry = self.telemetry
+        backup_call = backup._start_call()
+        backup.circuit_breaker.before_call()
+        call["hedged"] = True
+        try:
+            if backup.scheduler is not None:
+                async with backup.scheduler.slot(backup.priority, backup.session_id, backup._estimate_tokens(max_tokens)) as wait:
+                    backup_call["queue_wait"] += wait
+                    async for content in backup._stream_async(backup_call, None, max_tokens, kwargs):
+                        backup._first_token(backup_call)
+                        yield content
+            else:
+                async for content in backup._stream_async(backup_call, None, max_tokens, kwargs):
+                    backup._first_token(backup_call)
+                    yield content
+        except Exception as e:
+            backup.circuit_breaker.record_failure(e)
+            backup._end_call(backup_call, e)
+            raise
+        except BaseException as e:
+            # Lost the race and was closed, or cancelled
+            backup.circuit_breaker.record_cancelled()
+            backup._end_call(backup_call, e)
+            raise
+        backup.circuit_breaker.record_success()
+        backup._end_call(backup_call)
 
-    def get_response(self, color=None, should_print=True, response_model: Optional[BaseModel] = None, **kwargs):
+    def hedge_stats(self):
+        return self.hedge.summary() if self.hedge is not None else {}
+
+    def get_response(self, color=None, should_print=True, response_model: Optional[BaseModel] = None, on_chunk=None, **kwargs):
         if color is None:
             color = self.print_color
         
-        max_tokens = kwargs.pop('max_tokens', 4000)
-        anthropic_max_tokens = kwargs.pop('max_tokens', 8192)
+        max_tokens = kwargs.pop('max_tokens', None)
+        call = self._start_call()
+        try:
+            response = self._get_response(call, color, should_print, response_model, on_chunk, max_tokens, kwargs)
+        except BaseException as e:
+            self._end_call(call, e)
+            raise
+        self._end_call(call)
+        return response
 
+    def _get_response(self, call, color, should_print, response_model, on_chunk, max_tokens, kwargs):
+        self.conversation.fold()
         if self.use_cache:
             self.remove_previous_cache_keys()
 
-        retries = 0
-        while retries < self.max_retry:
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self._request_key(response_model, max_tokens, kwargs)
+            cached = self._cached_response(cache_key, response_model, color, should_print, on_chunk)
+            if cached is not None:
+                call["cache_hit"] = True
+                return cached
+
+        while True:
+            self.circuit_breaker.before_call()
             try:
-                if self.provider == "openai":
-                    if response_model:
-                        response = self.client.beta.chat.completions.parse(
-                            model=self.model,
-                            messages=[{"role": "system", "content": self.system_message}] + self.history,
-                            max_tokens=max_tokens,
-                            response_format=response_model,
-                            **kwargs
-                        )
-                    else:
-                        response = self.client.chat.completions.create(
-                            model=self.model,
-                            messages=[{"role": "system", "content": self.system_message}] + self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            response_format={"type": "json_object"} if self.json_mode else None,
-                            **kwargs
-                        )
-                elif self.provider == "anthropic":
-                    if self.use_cache:
-                        response = self.client.beta.prompt_caching.messages.create(
-                            model=self.model,
-                            system=[self.system_message],
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            # extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-                            **kwargs
-                        )
-                    else:
-                        response = self.client.messages.create(
-                            model=self.model,
-                            system=self.system_message,
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=anthropic_max_tokens,
-                            extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-                            **kwargs
-                        )
-                elif self.provider == "openrouter":
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=[{"role": "system", "content": self.system_message}] + self.history,
-                        stream=self.stream,
-                        max_tokens=max_tokens,
-                        **kwargs
-                    )
-                
-                if self.stream and not response_model:
-                    assistant_response = ""
-                    for chunk in response:
-                        if self.provider == "openai" or self.provider == "openrouter":
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                            else:
-                                content = None
-                        elif self.provider == "anthropic":
-                            content = chunk.delta.text if chunk.type == 'content_block_delta' else None
-                        
-                        if content:
-                            if should_print:
-                                print(colored(content, color), end="", flush=True)
-                            assistant_response += content
-                    print()
-                else:
-                    if self.provider == "openai" or self.provider == "openrouter":
-                        assistant_response = response.choices[0].message.content
-                    elif self.provider == "anthropic":
-                        assistant_response = response.content[0].text
-                    if self.use_cache and self.provider == "anthropic" and self.print_cache_usage:
-                        print(colored("\nCache Usage:", "yellow"))
-                        print(colored(f"Input tokens: {response.usage.input_tokens}", "yellow"))
-                        print(colored(f"Cache creation input tokens: {response.usage.cache_creation_input_tokens}", "yellow"))
-                        print(colored(f"Cache read input tokens: {response.usage.cache_read_input_tokens}", "yellow"))
-                        print(colored(f"Output tokens: {response.usage.output_tokens}", "yellow"))
-
-                if self.json_mode and self.provider == "openai":
-                    assistant_response = json.loads(assistant_response)
-
-                if response_model and self.provider == "openai":
-                    assistant_response = response.choices[0].message.parsed
-
-
-                self.add_message("assistant", str(assistant_response))
-                self.trim_history()
-                
-
-                
-                return assistant_response
+                assistant_response = self._attempt(call, response_model, max_tokens, kwargs, color, should_print, on_chunk)
+                parsed = self._parse_response(assistant_response, response_model)
+                self.circuit_breaker.record_success()
+                if cache_key is not None:
+                    self._store_response(cache_key, assistant_response, response_model)
+                return self._finish_response(parsed, response_model)
+            except InvalidResponse as e:
+                print("Error:", e)
+                self.circuit_breaker.record_success()
+                if call["validation_retries"] >= self.max_validation_retries:
+                    raise
+                call["validation_retries"] += 1
+                self._ask_to_fix(e)
             except Exception as e:
                 print("Error:", e)
-                retries += 1
-                time.sleep(1)
-        raise Exception("Max retries reached")
+                self.circuit_breaker.record_failure(e)
+                call["retries"] += 1
+                delay = self._retry_delay(e, call["retries"])
+                time.sleep(delay)
+            except BaseException:
+                # Interrupted before an outcome, e.g. a stream() consumer stopped reading
+                self.circuit_breaker.record_cancelled()
+                raise
 
-    async def get_response_async(self, color=None, should_print=True, response_model: Optional[BaseModel] = None, **kwargs):
+    async def get_response_async(self, color=None, should_print=True, response_model: Optional[BaseModel] = None, on_chunk=None, **kwargs):
         if color is None:
             color = self.print_color
         
-        max_tokens = kwargs.pop('max_tokens', 4000)
-        anthropic_max_tokens = kwargs.pop('max_tokens', 8192)
-        
+        max_tokens = kwargs.pop('max_tokens', None)
+        call = self._start_call()
+        try:
+            response = await self._get_response_async(call, color, should_print, response_model, on_chunk, max_tokens, kwargs)
+        except BaseException as e:
+            self._end_call(call, e)
+            raise
+        self._end_call(call)
+        return response
+
+    async def _get_response_async(self, call, color, should_print, response_model, on_chunk, max_tokens, kwargs):
+        self.conversation.fold()
         if self.use_cache:
             self.remove_previous_cache_keys()
 
-        retries = 0
-        while retries < self.max_retry:
-            try:
-                if self.provider == "openai":
-                    if response_model:
-                        response = await self.client.beta.chat.completions.parse(
-                            model=self.model,
-                            messages=[{"role": "system", "content": self.system_message}] + self.history,
-                            max_tokens=max_tokens,
-                            response_format=response_model,
-                            **kwargs
-                        )
-                    else:
-                        response = await self.client.chat.completions.create(
-                            model=self.model,
-                            messages=[{"role": "system", "content": self.system_message}] + self.history,
-                            stream=self.stream,
-                            max_tokens=max_tokens,
-                            response_format={"type": "json_object"} if self.json_mode else None,
-                            **kwargs
-                        )
-                elif self.provider == "anthropic":
-                    if self.use_cache:
-                        response = await self.client.beta.prompt_caching.messages.create(
-                            model=self.model,
-                            system=[self.system_message],
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=anthropic_max_tokens,
-                            extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-                            **kwargs
-                        )
-                    else:
-                        response = await self.client.messages.create(
-                            model=self.model,
-                            system=self.system_message,
-                            messages=self.history,
-                            stream=self.stream,
-                            max_tokens=anthropic_max_tokens,
-                            extra_headers={"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"},
-                            **kwargs
-                        )
-                elif self.provider == "openrouter":
-                    response = await self.client.chat.completions.create(
-                        model=self.model,
-                        messages=[{"role": "system", "content": self.system_message}] + self.history,
-                        stream=self.stream,
-                        max_tokens=max_tokens,
-                        **kwargs
-                    )
-
-                if self.stream and not response_model:
-                    assistant_response = ""
-                    async for chunk in response:
-                        if self.provider == "openai" or self.provider == "openrouter":
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                            else:
-                                content = None
-                        elif self.provider == "anthropic":
-                            content = chunk.delta.text if chunk.type == 'content_block_delta' else None
-                        
-                        if content:
-                            if should_print:
-                                print(colored(content, color), end="", flush=True)
-                            assistant_response += content
-                    print()
-                else:
-                    if self.provider == "openai" or self.provider == "openrouter":
-                        assistant_response = response.choices[0].message.content
-                    elif self.provider == "anthropic":
-                        assistant_response = response.content[0].text
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self._request_key(response_model, max_tokens, kwargs)
+            cached = self._cached_response(cache_key, response_model, color, should_print, on_chunk)
+            if cached is not None:
+                call["cache_hit"] = True
+                return cached
 
-                if self.json_mode and self.provider == "openai":
-                    assistant_response = json.loads(assistant_response)
+        if self.single_flight is None:
+            assistant_response = await self._request_async(call, color, should_print, response_model, on_chunk, max_tokens, kwargs, cache_key)
+            return self._finish_response(assistant_response, response_model)
 
-                if response_model and self.provider == "openai":
-                    assistant_response = response.choices[0].message.parsed
+        streaming = self._is_streaming(response_model)
+        key = (cache_key or self._request_key(response_model, max_tokens, kwargs), streaming)
+        if streaming:
+            def subscriber(content):
+                self._emit_chunk(content, color, should_print, on_chunk)
+        else:
+            subscriber = on_chunk
+        # The shared call publishes its chunks, each caller prints and forwards them itself
+        assistant_response, call["coalesced"] = await self.single_flight.run(
+            key,
+            lambda publish: self._request_async(call, color, False, response_model, publish, max_tokens, kwargs, cache_key),
+            on_chunk=subscriber,
+        )
+        if streaming:
+            self._end_stream(should_print)
+        if call["coalesced"]:
+            # The leader parsed the reply once; each follower gets its own copy of the result
+            assistant_response = copy.deepcopy(assistant_response)
+        return self._finish_response(assistant_response, response_model)
 
-                await self.add_message_async("assistant", str(assistant_response))
-                await self.trim_history_async()
-                return assistant_response
+    async def _request_async(self, call, color, should_print, response_model, on_chunk, max_tokens, kwargs, cache_key):
+        while True:
+            self.circuit_breaker.before_call()
+            try:
+                if self.scheduler is not None:
+                    async with self.scheduler.slot(self.priority, self.session_id, self._estimate_tokens(max_tokens)) as wait:
+                        call["queue_wait"] += wait
+                        assistant_response = await self._attempt_async(call, response_model, max_tokens, kwargs, color, should_print, on_chunk)
+                else:
+                    assistant_response = await self._attempt_async(call, response_model, max_tokens, kwargs, color, should_print, on_chunk)
+                parsed = self._parse_response(assistant_response, response_model)
+                self.circuit_breaker.record_success()
+                if cache_key is not None:
+                    self._store_response(cache_key, assistant_response, response_model)
+                return parsed
+            except InvalidResponse as e:
+                print("Error:", e)
+                self.circuit_breaker.record_success()
+                if call["validation_retries"] >= self.max_validation_retries:
+                    raise
+                call["validation_retries"] += 1
+                self._ask_to_fix(e)
             except Exception as e:
                 print("Error:", e)
-                retries += 1
-                await asyncio.sleep(1)
-        raise Exception("Max retries reached")
-    
+                self.circuit_breaker.record_failure(e)
+                call["retries"] += 1
+                delay = self._retry_delay(e, call["retries"])
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled, e.g. a sibling stage failed or the job was cancelled
+                self.circuit_breaker.record_cancelled()
+                raise
+
+    async def stream_async(self, user_input=None, context=None, **kwargs):
+        """Streams a reply as it is generated, for callers that consume the text themselves.
+
+        Adds ``user_input`` (if given) as a user message and yields ``{"type": "delta", "text": ...}``
+        for each piece of text, then one ``{"type": "usage", ...}`` with the token counts of the
+        call. The reply goes through the same cache, retries and history as ``chat_async``, and
+        nothing is echoed to the sink. Stopping the iteration early cancels the request.
+        """
+        if user_input is not None:
+            await self.add_message_async("user", user_input)
+            self.turn_context = context
+        deltas = asyncio.Queue()
+        task = asyncio.ensure_future(
+            self.get_response_async(should_print=False, on_chunk=deltas.put_nowait, **kwargs)
+        )
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
+        try:
+            while True:
+                content = await deltas.get()
+                if content is None:
+                    break
+                yield {"type": "delta", "text": content}
+            await task
+            yield self._usage_event()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    def stream(self, user_input=None, context=None, **kwargs):
+        """Blocking counterpart of ``stream_async``: the request runs on the background event loop
+        (async clients) or a worker thread while the deltas are yielded. Stopping the iteration
+        early cancels the request; a blocking request is stopped at its next chunk.
+        """
+        if user_input is not None:
+            self.add_message("user", user_input)
+            self.turn_context = context
+        deltas = queue.Queue()
+        if self.use_async:
+            future = get_background_loop().submit(
+                self.get_response_async(should_print=False, on_chunk=deltas.put, **kwargs)
+            )
+            future.add_done_callback(lambda _: deltas.put(None))
+            cancel = future.cancel
+        else:
+            future = concurrent.futures.Future()
+            stopped = threading.Event()
+
+            def on_chunk(content):
+                if stopped.is_set():
+                    # Ends the request the way a cancelled async one ends
+                    raise asyncio.CancelledError()
+                deltas.put(content)
+
+            def run():
+                try:
+                    future.set_result(self.get_response(should_print=False, on_chunk=on_chunk, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                deltas.put(None)
+
+            threading.Thread(target=run, name=f"{self.name}-stream", daemon=True).start()
+            cancel = stopped.set
+        try:
+            while True:
+                content = deltas.get()
+                if content is None:
+                    break
+                yield {"type": "delta", "text": content}
+            future.result()
+            yield self._usage_event()
+        finally:
+            if not future.done():
+                cancel()
+
+    def _usage_event(self):
+        call = self.last_call or {}
+        return {
+            "type": "usage",
+            **{field: call.get(field, 0) for field in TOKEN_FIELDS},
+            "cache_hit": call.get("cache_hit", False),
+        }
+
     """
 instructions for the AI using unified to build apps:
 when using async methods set use_async=True